@@ -0,0 +1,1382 @@
+"""
+Ad group structure & status analysis engine, shared by the Streamlit app and the batch CLI
+"""
+import pandas as pd
+import numpy as np
+import re
+import os
+import io
+import json
+import hashlib
+import multiprocessing
+import threading
+import zipfile
+from collections import Counter, OrderedDict
+from contextlib import nullcontext
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+from openpyxl import load_workbook
+
+# Ad group naming structures that count as a valid IM_VDP ad group, keyed by deal type
+DEFAULT_AD_GROUP_PATTERNS = {
+    'New - Lease': r'New - Lease- \d{4}',
+    'Lease or Other': r'Lease or Other \d{4}',
+    'Other Deal': r'Other Deal \d{4}',
+    'Finance Other': r'Finance Other \d{4}',
+    'New - Rebate Deal': r'New - Rebate Deal- \d{4}',
+    'New - Deal': r'New - Deal - \d{4}',
+    'Other or Finance': r'Other or Finance \d{4}',
+    'Finance or Other': r'Finance or Other \d{4}',
+    'Lease or Finance': r'Lease or Finance \d{4}'
+}
+
+# Optional JSON file ({"Deal type": "regex", ...}) that adds to or overrides the defaults
+PATTERNS_CONFIG_FILE = os.environ.get(
+    'AD_GROUP_PATTERNS_FILE',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'ad_group_patterns.json')
+)
+
+# Placeholder rows written for accounts without usable ad groups
+NO_ADGROUPS_FOUND = 'No IM_VDP ad groups found'
+NO_VALID_STRUCTURE = 'No Ad groups with valid Structure is found'
+NO_ACTIVE_CAMPAIGNS = 'No active campaigns'
+
+# Boolean column added to the ad report by add_ads_active_column
+ADS_ACTIVE_COLUMN = 'Ads active'
+
+RESULT_COLUMNS = ['Account name', 'Customer ID', 'Campaign', 'Ad group', 'ads', 'keywords', 'Deal type']
+
+# Columns held as int64 keys once a report is normalized, and the key of a
+# missing or unreadable ID
+ID_COLUMNS = ['Customer ID', 'Ad group ID']
+MISSING_KEY = -1
+# DataFrame.attrs key under which normalize_report keeps the text of IDs it could not parse
+UNPARSED_IDS = 'unparsed_ids'
+
+class AdGroupPatternRegistry:
+    """
+    Ad group patterns compiled once into a single alternation
+    
+    Each pattern gets its own named group so a match also tells which deal
+    type it belongs to. When several patterns match, the leftmost match wins.
+    """
+    def __init__(self, patterns=None):
+        self.patterns = {}
+        self._combined = None
+        for name, pattern in (patterns or DEFAULT_AD_GROUP_PATTERNS).items():
+            self.add(name, pattern)
+    
+    def add(self, name, pattern):
+        """
+        Add a pattern (or replace the one with the same name) and recompile
+
+        The whole alternation is compiled before the pattern is kept: a
+        pattern can be valid on its own but not inside it (e.g. a global
+        inline flag like "(?i)", or a group name another pattern uses).
+        """
+        patterns = dict(self.patterns)
+        patterns[name] = pattern
+        try:
+            combined = self._compile(patterns)
+        except re.error as e:
+            raise ValueError(f"Invalid ad group pattern '{name}': {e}")
+        self.patterns = patterns
+        self._combined = combined
+    
+    @staticmethod
+    def _compile(patterns):
+        return re.compile('|'.join(
+            f'(?P<_p{idx}>{pattern})' for idx, pattern in enumerate(patterns.values())
+        ))
+    
+    @property
+    def names(self):
+        return list(self.patterns)
+    
+    @property
+    def combined(self):
+        return self._combined
+    
+    def match(self, ad_group_series):
+        """
+        Match a whole 'Ad group' column in one pass
+        
+        Returns a frame with the matched ad group text ('Ad group') and the
+        deal type ('Deal type'); both are None for rows that do not match.
+        """
+        result = pd.DataFrame({'Ad group': None, 'Deal type': None}, index=ad_group_series.index, dtype=object)
+        has_text = ad_group_series.notna() & (ad_group_series != "")
+        if not has_text.any():
+            return result
+        
+        # Ad group names repeat across ads, so only distinct names go through the regex
+        text = ad_group_series[has_text].astype(str)
+        codes, uniques = pd.factorize(text)
+        group_names = [f'_p{idx}' for idx in range(len(self.patterns))]
+        extracted = pd.Series(uniques, dtype=object).str.extract(self.combined)[group_names]
+        groups = extracted.notna().to_numpy()
+        unique_matched = groups.any(axis=1)
+        unique_deal_type = np.array(self.names, dtype=object)[groups.argmax(axis=1)]
+        
+        matched = unique_matched[codes]
+        rows = text.index[matched]
+        result.loc[rows, 'Ad group'] = text[matched].to_numpy()
+        result.loc[rows, 'Deal type'] = unique_deal_type[codes[matched]]
+        return result
+
+def load_pattern_registry(path=None):
+    """
+    Default patterns extended with the ones from the JSON config file, if present
+    """
+    path = path or PATTERNS_CONFIG_FILE
+    registry = AdGroupPatternRegistry()
+    if path and os.path.exists(path):
+        with open(path, encoding='utf-8') as f:
+            extra = json.load(f)
+        if not isinstance(extra, dict):
+            raise ValueError(f"{path} must map deal type names to regular expressions")
+        for name, pattern in extra.items():
+            registry.add(name, pattern)
+    return registry
+
+# A broken config file falls back to the defaults; callers report the error
+PATTERNS_CONFIG_ERROR = None
+try:
+    pattern_registry = load_pattern_registry()
+except (OSError, ValueError) as e:
+    PATTERNS_CONFIG_ERROR = f"Could not load ad group patterns from {PATTERNS_CONFIG_FILE}: {str(e)}"
+    pattern_registry = AdGroupPatternRegistry()
+
+def is_creative_column(col):
+    """
+    Whether a column is a headline (Headline 1 to Headline 15) or description
+    (Description 1 to Description 4) column
+    """
+    return col != ADS_ACTIVE_COLUMN and ('headline' in str(col).lower() or 'description' in str(col).lower())
+
+def get_creative_columns(adgroup_df):
+    """
+    Headline and description columns of an ad report
+    """
+    return [col for col in adgroup_df.columns if is_creative_column(col)]
+
+def check_ads_active(adgroup_df, creative_cols=None):
+    """
+    Check if ads are active by looking at headline and description columns
+    
+    Returns one boolean per row: True when any headline or description holds
+    something other than blanks or "--".
+    """
+    if creative_cols is None:
+        creative_cols = get_creative_columns(adgroup_df)
+    if not creative_cols or len(adgroup_df) == 0:
+        return pd.Series(False, index=adgroup_df.index)
+    
+    cells = adgroup_df[creative_cols].to_numpy(dtype=object)
+    filled = pd.notna(cells)
+    
+    # Ad copy repeats a lot, so blanks are decided once per distinct value
+    codes, uniques = pd.factorize(cells[filled])
+    blank = pd.Series(uniques, dtype=object).astype(str).str.strip().isin(["", "--"]).to_numpy()
+    
+    has_content = np.zeros(cells.shape, dtype=bool)
+    has_content[filled] = ~blank[codes]
+    return pd.Series(has_content.any(axis=1), index=adgroup_df.index)
+
+def add_ads_active_column(adgroup_df):
+    """
+    Store the ads check as a boolean column so it is computed once per file
+    """
+    adgroup_df[ADS_ACTIVE_COLUMN] = check_ads_active(adgroup_df)
+    return adgroup_df
+
+def id_keys(values):
+    """
+    Canonical int64 key of each Customer ID / Ad group ID
+
+    Hyphens, spaces and a trailing ".0" are ignored, so "123-456-7890",
+    1234567890 and "1234567890.0" share a key; missing, "--" and non-numeric
+    IDs get MISSING_KEY. Text is parsed once per distinct value, and integer
+    input (already keyed) is returned as it is.
+    """
+    if not isinstance(values, pd.Series):
+        values = pd.Series(values, dtype=None if len(values) else object)
+    if pd.api.types.is_integer_dtype(values.dtype):
+        return values.fillna(MISSING_KEY).to_numpy(dtype=np.int64)
+    
+    codes, uniques = pd.factorize(values)
+    text = (
+        pd.Series(uniques, dtype=object).astype(str).str.strip()
+        .str.replace(r'\.0+$', '', regex=True).str.replace(r'[\s-]', '', regex=True)
+    )
+    numeric = text.str.fullmatch(r'\d{1,18}').to_numpy(dtype=bool)
+    unique_keys = np.full(len(uniques), MISSING_KEY, dtype=np.int64)
+    unique_keys[numeric] = text[numeric].astype(np.int64).to_numpy()
+    # Missing values (code -1) pick the MISSING_KEY appended at the end
+    return np.append(unique_keys, MISSING_KEY)[codes]
+
+def _format_customer_id(key):
+    digits = str(key)
+    if len(digits) > 10:
+        return digits
+    digits = digits.zfill(10)
+    return f'{digits[:3]}-{digits[3:6]}-{digits[6:]}'
+
+def format_customer_ids(values):
+    """
+    Customer IDs (keys or text) in the Google Ads "123-456-7890" form, for
+    display and export; None where the ID is missing
+    """
+    codes, uniques = pd.factorize(id_keys(values))
+    text = np.array([None if key == MISSING_KEY else _format_customer_id(key) for key in uniques], dtype=object)
+    return text[codes]
+
+def _null_dashes(series):
+    """
+    "--" cells (Google Ads' empty value) as null, decided once per distinct value
+    """
+    codes, uniques = pd.factorize(series)
+    dashes = pd.Series(uniques, dtype=object).astype(str).str.strip().eq('--').to_numpy()
+    if not dashes.any():
+        return series
+    return series.mask(np.append(dashes, False)[codes])
+
+def normalize_report(df):
+    """
+    Normalize a freshly read report once: "--" cells become null in every
+    text column and the ID_COLUMNS become int64 keys (id_keys), so that all
+    later joins and lookups hash integers
+
+    IDs that are present but not numbers cannot be matched; their text is
+    kept in df.attrs (see unparsed_ids) so they can be reported.
+    """
+    for col in df.columns:
+        if df[col].dtype == object:
+            df[col] = _null_dashes(df[col])
+    unparsed = {}
+    for col in ID_COLUMNS:
+        if col in df.columns:
+            keys = id_keys(df[col])
+            failed = (keys == MISSING_KEY) & df[col].notna().to_numpy()
+            if failed.any():
+                unparsed[col] = pd.unique(df.loc[failed, col].astype(str)).tolist()
+            df[col] = keys
+    if unparsed:
+        df.attrs[UNPARSED_IDS] = unparsed
+    return df
+
+def unparsed_ids(df, column='Customer ID'):
+    """
+    Distinct text of the IDs in column that normalize_report could not parse
+    """
+    return df.attrs.get(UNPARSED_IDS, {}).get(column, [])
+
+def unparsed_accounts_message(accounts_df, shown=10):
+    """
+    Warning naming the listed accounts that are skipped because their
+    Customer ID is not a number, or None when there are none
+    """
+    ids = unparsed_ids(accounts_df)
+    if not ids:
+        return None
+    listed = ', '.join(ids[:shown])
+    if len(ids) > shown:
+        listed += f" and {len(ids) - shown} more"
+    return f"{len(ids)} listed account(s) were skipped because their Customer ID is not a number: {listed}"
+
+class KeywordIndex:
+    """
+    Keyword counts per Ad group ID, built once per keyword report
+    
+    Lookups go through a hashed pandas Index of Ad group ID keys (id_keys)
+    instead of scanning the keyword report for every ad group. Keyword rows
+    without a usable Ad group ID belong to no ad group and are left out.
+    """
+    def __init__(self, counts):
+        # Series: Ad group ID key -> number of keyword rows
+        self.counts = counts
+    
+    @classmethod
+    def from_frame(cls, keyword_df):
+        """
+        Build the index from a keyword report DataFrame
+        """
+        if keyword_df is None or 'Ad group ID' not in keyword_df.columns:
+            return cls(pd.Series(dtype='int64'))
+        
+        keys = id_keys(keyword_df['Ad group ID'])
+        known = keys != MISSING_KEY
+        keys = pd.Series(keys[known], name='Ad group ID')
+        return cls(keys.value_counts(sort=False).rename(None).rename_axis(None))
+    
+    @classmethod
+    def from_counters(cls, counts):
+        """
+        Build the index from an {Ad group ID: count} dictionary (IDs as read, or keys)
+        """
+        keys = id_keys(list(counts))
+        known = keys != MISSING_KEY
+        if not known.any():
+            return cls(pd.Series(dtype='int64'))
+        # Spellings of the same ID ("123", "123.0") add up under one key
+        counts = pd.Series(list(counts.values()), index=keys, dtype='int64')[known]
+        return cls(counts.groupby(level=0, sort=False).sum())
+    
+    @classmethod
+    def combine(cls, indexes):
+        """
+        One index covering several keyword reports
+        """
+        indexes = list(indexes)
+        counts = pd.concat([index.counts for index in indexes])
+        return cls(counts.groupby(level=0, dropna=False, sort=False).sum())
+    
+    def to_frame(self):
+        """
+        Flat frame (one row per Ad group ID) used to cache the index
+        """
+        return self.counts.rename('keywords').rename_axis('Ad group ID').reset_index()
+    
+    @classmethod
+    def from_index_frame(cls, frame):
+        """
+        Inverse of to_frame
+        """
+        frame = frame.set_index('Ad group ID').rename_axis(None)
+        return cls(frame['keywords'].astype('int64'))
+    
+    @property
+    def keyword_rows(self):
+        return int(self.counts.sum())
+    
+    def __len__(self):
+        return len(self.counts)
+    
+    def count(self, ad_group_ids):
+        """
+        Keyword count for each given Ad group ID (0 when it has no keywords)
+        """
+        if len(self.counts) == 0:
+            return np.zeros(len(ad_group_ids), dtype='int64')
+        positions = self.counts.index.get_indexer(id_keys(ad_group_ids))
+        return np.where(positions >= 0, self.counts.to_numpy()[positions], 0)
+    
+    def contains(self, ad_group_ids):
+        """
+        Whether each given Ad group ID has at least one keyword
+        """
+        return self.count(ad_group_ids) > 0
+
+def _stage(profiler, name, rows=None):
+    """
+    profiler.stage(name, rows), or a no-op when no profiler is given
+    """
+    if profiler is None:
+        return nullcontext({})
+    return profiler.stage(name, rows)
+
+def build_results(accounts_df, keyword_df, adgroup_df, keyword_index=None, profiler=None):
+    """
+    Process Google Ads data according to the project requirements
+    
+    All accounts are handled at once with column operations; the rows and
+    their order match the original per-account loop. Reports are expected to
+    be normalized (normalize_report, done by read_report): accounts and ad
+    groups are joined on their int64 Customer ID / Ad group ID keys, and the
+    results carry the Customer ID key. A prebuilt KeywordIndex can be passed
+    to avoid indexing keyword_df again. Returns a DataFrame with
+    RESULT_COLUMNS. With a profiler (profiling.StageProfiler) every step is
+    recorded as its own stage.
+    """
+    # Step 1: Get unique Customer IDs from accounts_list
+    if 'Customer ID' not in accounts_df.columns:
+        raise ValueError("'Customer ID' column not found in accounts_list.xlsx")
+    
+    # First occurrence of each Customer ID provides the account name
+    with _stage(profiler, 'account_lookup', len(adgroup_df)):
+        account_keys = id_keys(accounts_df['Customer ID'])
+        first = (account_keys != MISSING_KEY) & ~pd.Series(account_keys).duplicated().to_numpy()
+        accounts = accounts_df[first]
+        customer_ids = account_keys[first]
+        if 'Account name' in accounts.columns:
+            account_names = accounts['Account name'].to_numpy()
+        else:
+            account_names = np.full(len(accounts), "", dtype=object)
+    
+        # Position of every ad group row's customer in the accounts list (-1 = not listed)
+        if 'Customer ID' in adgroup_df.columns and len(adgroup_df) > 0:
+            adgroup_df = adgroup_df.reset_index(drop=True)
+            position = pd.Index(customer_ids).get_indexer(id_keys(adgroup_df['Customer ID']))
+        else:
+            adgroup_df = pd.DataFrame(index=pd.RangeIndex(0))
+            position = np.empty(0, dtype=np.intp)
+        listed = position >= 0
+    
+    def column(name):
+        if name in adgroup_df.columns:
+            return adgroup_df[name]
+        return pd.Series("", index=adgroup_df.index, dtype=object)
+    
+    # Step 2: Keep ad groups with a valid structure that are Enabled
+    with _stage(profiler, 'pattern_match', len(adgroup_df)):
+        matches = pattern_registry.match(column('Ad group'))
+        ad_group_pattern = matches['Ad group']
+        valid = listed & ad_group_pattern.notna().to_numpy() & (column('Ad state') == 'Enabled').to_numpy()
+        valid_rows = adgroup_df[valid]
+    
+    # Step 3: Ads and keywords flags for the valid ad groups only
+    with _stage(profiler, 'ads_check', int(valid.sum())):
+        if ADS_ACTIVE_COLUMN in valid_rows.columns:
+            ads_active = valid_rows[ADS_ACTIVE_COLUMN].astype(bool)
+        else:
+            ads_active = check_ads_active(valid_rows)
+    
+    with _stage(profiler, 'keyword_join', int(valid.sum())):
+        # Ad group IDs that are missing or "--" have MISSING_KEY, which the index never holds
+        if keyword_index is None:
+            keyword_index = KeywordIndex.from_frame(keyword_df)
+        keywords_active = keyword_index.contains(column('Ad group ID')[valid])
+    
+    with _stage(profiler, 'assemble_results') as record:
+        campaign = column('Campaign')[valid]
+        campaign = campaign.where(campaign.notna() & (campaign != ""), NO_ACTIVE_CAMPAIGNS)
+    
+        valid_position = position[valid]
+        found = pd.DataFrame({
+            'position': valid_position,
+            'Account name': account_names[valid_position],
+            'Customer ID': customer_ids[valid_position],
+            'Campaign': campaign.to_numpy(),
+            'Ad group': ad_group_pattern[valid].to_numpy(),
+            'ads': np.where(ads_active.to_numpy(), 'active', 'not active'),
+            'keywords': np.where(keywords_active, 'active', 'not active'),
+            'Deal type': matches['Deal type'][valid].to_numpy()
+        })
+    
+        # Step 4: Placeholder rows for accounts without any valid ad group
+        first_rows = pd.Series(position[listed]).drop_duplicates()
+        first_campaign = pd.Series(np.nan, index=range(len(customer_ids)), dtype=object)
+        if len(first_rows) > 0:
+            first_row_index = np.flatnonzero(listed)[first_rows.index]
+            first_campaign[first_rows.to_numpy()] = column('Campaign').to_numpy()[first_row_index]
+    
+        has_adgroups = np.zeros(len(customer_ids), dtype=bool)
+        has_adgroups[position[listed]] = True
+        has_valid = np.zeros(len(customer_ids), dtype=bool)
+        has_valid[valid_position] = True
+    
+        missing = np.flatnonzero(~has_valid)
+        missing_campaign = first_campaign[missing]
+        missing_campaign = missing_campaign.where(
+            missing_campaign.notna() & (missing_campaign != ""), NO_ACTIVE_CAMPAIGNS
+        )
+        missing_has_adgroups = has_adgroups[missing]
+        placeholders = pd.DataFrame({
+            'position': missing,
+            'Account name': account_names[missing],
+            'Customer ID': customer_ids[missing],
+            'Campaign': np.where(missing_has_adgroups, missing_campaign.to_numpy(), NO_ACTIVE_CAMPAIGNS),
+            'Ad group': np.where(missing_has_adgroups, NO_VALID_STRUCTURE, NO_ADGROUPS_FOUND),
+            'ads': 'not active',
+            'keywords': 'not active',
+            'Deal type': None
+        })
+    
+        # Stable sort keeps accounts in list order and ad groups in report order
+        results = pd.concat([found, placeholders], ignore_index=True)
+        results = results.sort_values('position', kind='stable')
+        record['rows'] = len(results)
+        return results[RESULT_COLUMNS].reset_index(drop=True)
+
+
+def build_account_analysis(result_df, adgroup_df, keyword_index=None):
+    """
+    Per-account, per-ad-group aggregates for the Account Analysis section
+    
+    Computed once when the results are produced so that switching accounts is
+    a dictionary lookup. Returns {account name: [ad group analysis, ...]} with
+    accounts and ad groups in the order they first appear in the results.
+    """
+    if len(result_df) == 0:
+        return {}
+    
+    valid_rows = result_df[
+        (result_df['Account name'] != 'N/A') &
+        (result_df['Ad group'] != NO_ADGROUPS_FOUND) &
+        (result_df['Ad group'] != NO_VALID_STRUCTURE) &
+        result_df['Account name'].notna()
+    ]
+    if len(valid_rows) == 0:
+        return {}
+    
+    keys = ['Account name', 'Ad group']
+    grouped = valid_rows.assign(
+        ads_active=valid_rows['ads'] == 'active',
+        keywords_active=valid_rows['keywords'] == 'active'
+    ).groupby(keys, sort=False)
+    
+    # Customer ID and campaign come from the first occurrence of each ad group
+    analysis = valid_rows.drop_duplicates(keys)[keys + ['Customer ID', 'Campaign']].reset_index(drop=True)
+    analysis['ads_count'] = grouped.size().to_numpy()
+    analysis['ads_active'] = grouped['ads_active'].any().to_numpy()
+    analysis['keywords_active'] = grouped['keywords_active'].any().to_numpy()
+    
+    # Keywords count: keywords of every Ad group ID carrying this ad group name for this customer
+    analysis['keywords_count'] = 0
+    if (
+        adgroup_df is not None and keyword_index is not None and
+        {'Ad group', 'Customer ID', 'Ad group ID'} <= set(adgroup_df.columns)
+    ):
+        id_pairs = pd.DataFrame({
+            'Ad group': adgroup_df['Ad group'].to_numpy(),
+            'Customer ID': id_keys(adgroup_df['Customer ID']),
+            'Ad group ID': id_keys(adgroup_df['Ad group ID'])
+        }).drop_duplicates()
+        id_pairs = id_pairs.assign(keywords_count=keyword_index.count(id_pairs['Ad group ID']))
+        keyword_counts = id_pairs.groupby(['Ad group', 'Customer ID'], dropna=False)['keywords_count'].sum()
+        lookup = pd.MultiIndex.from_arrays([analysis['Ad group'], id_keys(analysis['Customer ID'])])
+        positions = keyword_counts.index.get_indexer(lookup)
+        analysis['keywords_count'] = np.where(positions >= 0, keyword_counts.to_numpy()[positions], 0)
+    
+    account_analysis = {}
+    analysis = analysis.rename(columns={'Account name': 'account', 'Ad group': 'ad_group', 'Campaign': 'campaign'})
+    for row in analysis.itertuples(index=False):
+        account_analysis.setdefault(row.account, []).append({
+            'ad_group': row.ad_group,
+            'campaign': row.campaign,
+            'ads_status': 'active' if row.ads_active else 'not active',
+            'ads_count': int(row.ads_count),
+            'keywords_status': 'active' if row.keywords_active else 'not active',
+            'keywords_count': int(row.keywords_count)
+        })
+    return account_analysis
+
+# Columns of an account's ad group analysis, as used by ad_group_table
+ANALYSIS_COLUMNS = ['ad_group', 'campaign', 'ads_status', 'ads_count', 'keywords_status', 'keywords_count']
+
+def ad_group_table(adgroup_analysis, ads_status=None, keywords_status=None, sort_by=None, descending=False):
+    """
+    An account's ad group analysis as a DataFrame, filtered and sorted
+
+    adgroup_analysis is one entry of build_account_analysis. sort_by is one
+    of ANALYSIS_COLUMNS (None keeps report order); the 'no' column numbers
+    the ad groups in report order.
+    """
+    frame = pd.DataFrame(adgroup_analysis, columns=ANALYSIS_COLUMNS)
+    frame.insert(0, 'no', np.arange(1, len(frame) + 1))
+    if ads_status is not None:
+        frame = frame[frame['ads_status'] == ads_status]
+    if keywords_status is not None:
+        frame = frame[frame['keywords_status'] == keywords_status]
+    if sort_by is not None:
+        frame = frame.sort_values(sort_by, ascending=not descending, kind='stable')
+    return frame.reset_index(drop=True)
+
+def compact_results(result_df):
+    """
+    Results in a compact columnar form for keeping after a run
+
+    Text columns repeat heavily (one account name, campaign and deal type per
+    many rows), so all of them are stored as categoricals; ads and keywords
+    only take 'active' / 'not active'. Customer ID keys are shown in the
+    123-456-7890 form. Displays and exports the same values.
+    """
+    compact = result_df.copy()
+    for col in compact.columns:
+        if col == 'Customer ID':
+            compact[col] = pd.Categorical(format_customer_ids(compact[col]))
+        elif col in ('ads', 'keywords'):
+            compact[col] = pd.Categorical(compact[col], categories=['not active', 'active'])
+        else:
+            compact[col] = compact[col].astype('category')
+    return compact
+
+# Columns each upload needs; everything else in the workbook is skipped
+ACCOUNTS_COLUMNS = ['Customer ID', 'Account name']
+KEYWORD_COLUMNS = ['Ad group ID']
+ADGROUP_COLUMNS = ['Customer ID', 'Campaign', 'Ad group', 'Ad group ID', 'Ad state']
+
+# Every kept column is read as text: IDs then compare equal across the three
+# exports and no per-column type inference is needed. States become categories.
+CATEGORY_COLUMNS = ['Ad state']
+
+def get_excel_engine():
+    """
+    Use the Rust based calamine reader when it is installed, openpyxl otherwise
+    """
+    try:
+        import python_calamine  # noqa: F401
+        return 'calamine'
+    except ImportError:
+        return 'openpyxl'
+
+EXCEL_ENGINE = get_excel_engine()
+
+def is_csv(file):
+    """
+    CSV exports are recognised by their file name; everything else is Excel
+    """
+    name = file if isinstance(file, str) else getattr(file, 'name', '')
+    return str(name).lower().endswith('.csv')
+
+def _streamed_rows(workbook):
+    """
+    Rows of a read-only workbook's first sheet as (row number, {column: value},
+    hidden), streamed once through openpyxl's worksheet parser, which records
+    each row's attributes (including hidden) as it yields the row
+
+    The parser is not public openpyxl API, so it is imported here and None is
+    returned when it cannot be set up.
+    """
+    source = None
+    try:
+        from openpyxl.worksheet._reader import WorkSheetParser
+        sheet = workbook.worksheets[0]
+        source = sheet._get_source()
+        parser = WorkSheetParser(
+            source,
+            sheet._shared_strings,
+            data_only=True,
+            epoch=workbook.epoch,
+            date_formats=workbook._date_formats,
+            timedelta_formats=workbook._timedelta_formats
+        )
+        row_dimensions = parser.row_dimensions
+    except (ImportError, AttributeError, TypeError):
+        if source is not None:
+            source.close()
+        return None
+
+    def rows():
+        with source:
+            for row_number, cells in parser.parse():
+                hidden = row_dimensions.get(str(row_number), {}).get('hidden') in ('1', 'true')
+                yield row_number, {cell['column']: cell['value'] for cell in cells}, hidden
+    return rows()
+
+def _loaded_rows(workbook):
+    """
+    Rows of a fully loaded workbook's first sheet as (row number,
+    {column: value}, hidden), through the public row_dimensions
+    """
+    sheet = workbook.worksheets[0]
+    for row in sheet.iter_rows():
+        if not row:
+            continue
+        row_number = row[0].row
+        dimension = sheet.row_dimensions.get(row_number)
+        yield row_number, {cell.column: cell.value for cell in row}, bool(dimension is not None and dimension.hidden)
+
+def read_visible_rows(file, usecols, skiprows=2):
+    """
+    Read the first sheet of an Excel report without its hidden rows
+    
+    Hidden rows are dropped while the frame is built from one streaming pass
+    (_streamed_rows) instead of reading the workbook twice; if openpyxl's
+    parser internals are not available, the workbook is loaded in full
+    instead (slower, same result). The header is the first row after
+    skiprows and is used even if hidden; cells are converted to text like
+    read_report does.
+    """
+    if hasattr(file, 'seek'):
+        file.seek(0)
+    workbook = load_workbook(file, read_only=True, data_only=True)
+    rows = _streamed_rows(workbook)
+    if rows is None:
+        workbook.close()
+        if hasattr(file, 'seek'):
+            file.seek(0)
+        # Row dimensions are only loaded outside read-only mode
+        workbook = load_workbook(file, data_only=True)
+        rows = _loaded_rows(workbook)
+    try:
+        keep = None
+        data = {}
+        for row_number, values, hidden in rows:
+            if row_number <= skiprows:
+                continue
+            if keep is None:
+                # Header row: column number -> name of the columns to keep
+                keep = {}
+                for column, value in sorted(values.items()):
+                    name = _cell_text(value)
+                    if name is not None and usecols(name) and name not in keep.values():
+                        keep[column] = name
+                data = {name: [] for name in keep.values()}
+                continue
+            if hidden:
+                continue
+            texts = [_cell_text(values.get(column)) for column in keep]
+            if not any(texts):
+                continue
+            for name, text in zip(keep.values(), texts):
+                data[name].append(text if text else np.nan)
+    finally:
+        workbook.close()
+    return pd.DataFrame(data, dtype=object)
+
+def read_report(file, columns, include_creatives=False, skiprows=2, visible_only=False):
+    """
+    Read one uploaded report, keeping only the columns the analysis uses,
+    and normalize it (normalize_report); with visible_only, rows hidden in an
+    Excel report are left out
+    """
+    def usecols(col):
+        return col in columns or (include_creatives and is_creative_column(col))
+    
+    if hasattr(file, 'seek'):
+        file.seek(0)
+    if is_csv(file):
+        df = pd.read_csv(file, skiprows=skiprows, usecols=usecols, dtype=str)
+    elif visible_only:
+        df = read_visible_rows(file, usecols, skiprows)
+    else:
+        df = pd.read_excel(file, skiprows=skiprows, usecols=usecols, dtype=str, engine=EXCEL_ENGINE)
+    normalize_report(df)
+    for col in CATEGORY_COLUMNS:
+        if col in df.columns:
+            df[col] = df[col].astype('category')
+    return df
+
+class ParseCache:
+    """
+    Parsed reports keyed by a hash of the uploaded bytes and the parse options
+    
+    Frames are kept in memory (least recently used evicted first once
+    max_memory_bytes is exceeded) and, when cache_dir is set, also written to
+    disk as Parquet with the same size-based eviction.
+    """
+    def __init__(self, max_memory_bytes, cache_dir=None, max_disk_bytes=0):
+        self.max_memory_bytes = max_memory_bytes
+        self.cache_dir = cache_dir
+        self.max_disk_bytes = max_disk_bytes
+        self._frames = OrderedDict()
+        self._sizes = {}
+        self._lock = threading.Lock()
+        self._disk_lock = threading.Lock()
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+    
+    @staticmethod
+    def make_key(data, **options):
+        digest = hashlib.sha256(data)
+        digest.update(repr(sorted(options.items())).encode('utf-8'))
+        return digest.hexdigest()
+    
+    def _disk_path(self, key):
+        return os.path.join(self.cache_dir, f'{key}.parquet')
+    
+    def get(self, key):
+        """
+        Cached frame for key, or None
+        """
+        with self._lock:
+            if key in self._frames:
+                self._frames.move_to_end(key)
+                return self._frames[key].copy(deep=False)
+        
+        if self.cache_dir and os.path.exists(self._disk_path(key)):
+            try:
+                df = pd.read_parquet(self._disk_path(key))
+                os.utime(self._disk_path(key))
+            except Exception:
+                # Unreadable, or evicted by another thread or process in the meantime
+                return None
+            self._remember(key, df)
+            return df.copy(deep=False)
+        return None
+    
+    def put(self, key, df):
+        self._remember(key, df)
+        if self.cache_dir:
+            # Threads and worker processes may write the same key at once
+            tmp_path = f'{self._disk_path(key)}.{os.getpid()}.{threading.get_ident()}.tmp'
+            try:
+                df.to_parquet(tmp_path, index=False)
+                os.replace(tmp_path, self._disk_path(key))
+            except Exception:
+                # The disk copy is only an optimization; keep the in-memory entry
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+            self._evict_disk()
+    
+    def _remember(self, key, df):
+        size = int(df.memory_usage(deep=True).sum())
+        with self._lock:
+            self._frames[key] = df
+            self._sizes[key] = size
+            self._frames.move_to_end(key)
+            while len(self._frames) > 1 and sum(self._sizes.values()) > self.max_memory_bytes:
+                oldest, _ = self._frames.popitem(last=False)
+                del self._sizes[oldest]
+    
+    def _evict_disk(self):
+        """
+        Delete the least recently used Parquet files beyond max_disk_bytes
+
+        Other threads and worker processes evict from the same directory, so
+        files that are already gone are skipped; .tmp files still being
+        written are never counted or removed.
+        """
+        with self._disk_lock:
+            entries = []
+            for name in os.listdir(self.cache_dir):
+                if not name.endswith('.parquet'):
+                    continue
+                path = os.path.join(self.cache_dir, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total <= self.max_disk_bytes:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+    
+    def clear(self):
+        with self._lock:
+            self._frames.clear()
+            self._sizes.clear()
+
+def parse_cache_from_env():
+    """
+    ParseCache sized by PARSE_CACHE_MAX_MB (memory, default 512); PARSE_CACHE_DIR
+    turns on the Parquet copy on disk, bounded by PARSE_CACHE_DISK_MAX_MB
+    (default 2048)
+    """
+    return ParseCache(
+        max_memory_bytes=int(os.environ.get('PARSE_CACHE_MAX_MB', 512)) * 1024 * 1024,
+        cache_dir=os.environ.get('PARSE_CACHE_DIR') or None,
+        max_disk_bytes=int(os.environ.get('PARSE_CACHE_DISK_MAX_MB', 2048)) * 1024 * 1024
+    )
+
+def read_report_cached(file, columns, include_creatives=False, skiprows=2, cache=None, visible_only=False):
+    """
+    read_report that skips Excel parsing when the same bytes were parsed before
+    """
+    if cache is None:
+        return read_report(file, columns, include_creatives, skiprows, visible_only)
+    
+    if hasattr(file, 'getvalue'):
+        data = file.getvalue()
+    else:
+        with open(file, 'rb') as f:
+            data = f.read()
+    key = ParseCache.make_key(
+        data,
+        csv=is_csv(file),
+        columns=tuple(columns),
+        include_creatives=include_creatives,
+        skiprows=skiprows,
+        engine=EXCEL_ENGINE,
+        dtype='str',
+        keys='int64',
+        visible_only=visible_only
+    )
+    df = cache.get(key)
+    if df is None:
+        buffer = io.BytesIO(data)
+        buffer.name = file if isinstance(file, str) else getattr(file, 'name', '')
+        df = read_report(buffer, columns, include_creatives, skiprows, visible_only)
+        cache.put(key, df)
+        df = df.copy(deep=False)
+    return df
+
+def read_uploads(accounts_file, keyword_file, adgroup_file, cache=None, stream_keywords=False):
+    """
+    Parse the three uploaded workbooks concurrently
+    
+    Returns (accounts_df, keyword_df, adgroup_df). With stream_keywords the
+    keyword report is only streamed into a KeywordIndex, which is returned in
+    place of keyword_df.
+    """
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        # Rows hidden in the accounts list exclude those accounts
+        accounts_future = executor.submit(
+            read_report_cached, accounts_file, ACCOUNTS_COLUMNS, cache=cache, visible_only=True
+        )
+        if stream_keywords:
+            keyword_future = executor.submit(read_keyword_index, keyword_file, cache=cache)
+        else:
+            keyword_future = executor.submit(read_report_cached, keyword_file, KEYWORD_COLUMNS, cache=cache)
+        adgroup_future = executor.submit(read_report_cached, adgroup_file, ADGROUP_COLUMNS, True, cache=cache)
+        return accounts_future.result(), keyword_future.result(), adgroup_future.result()
+
+def _cell_text(value):
+    """
+    Text of a worksheet cell as read_report would produce it (dtype=str)
+    """
+    if value is None:
+        return None
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value)
+
+def stream_keyword_index(file, skiprows=2, chunksize=200_000):
+    """
+    Build a KeywordIndex from a keyword report without loading it into a DataFrame
+    
+    Excel reports are walked row by row through a read-only openpyxl
+    worksheet and CSV reports are read in chunks, so memory grows with the
+    number of distinct ad groups rather than the number of keyword rows.
+    """
+    if hasattr(file, 'seek'):
+        file.seek(0)
+    counts = Counter()
+    
+    if is_csv(file):
+        def usecols(col):
+            return col in KEYWORD_COLUMNS
+        
+        for chunk in pd.read_csv(file, skiprows=skiprows, usecols=usecols, dtype=str, chunksize=chunksize):
+            if 'Ad group ID' not in chunk.columns:
+                return KeywordIndex.from_counters({})
+            ad_group_ids = chunk['Ad group ID'].astype(object).where(chunk['Ad group ID'].notna(), None)
+            counts.update(ad_group_ids.tolist())
+        return KeywordIndex.from_counters(counts)
+    
+    workbook = load_workbook(file, read_only=True, data_only=True)
+    try:
+        rows = workbook.worksheets[0].iter_rows(min_row=skiprows + 1, values_only=True)
+        header = next(rows, None) or ()
+        header = [_cell_text(col) for col in header]
+        if 'Ad group ID' not in header:
+            return KeywordIndex.from_counters({})
+        id_pos = header.index('Ad group ID')
+        
+        for row in rows:
+            if all(value is None for value in row):
+                continue
+            ad_group_id = _cell_text(row[id_pos]) if id_pos < len(row) else None
+            counts[ad_group_id] += 1
+    finally:
+        workbook.close()
+    return KeywordIndex.from_counters(counts)
+
+# Excel keyword reports at least this big are streamed row by row. openpyxl's
+# read-only mode bounds memory but is much slower than a regular (calamine)
+# read, which stays the better choice for small files. CSV is always chunked.
+KEYWORD_STREAM_MIN_BYTES = int(os.environ.get('KEYWORD_STREAM_MIN_MB', 25)) * 1024 * 1024
+
+def _index_keywords(file, size, skiprows):
+    """
+    Stream large or CSV keyword reports; read small workbooks in one go
+    """
+    if is_csv(file) or size >= KEYWORD_STREAM_MIN_BYTES:
+        return stream_keyword_index(file, skiprows)
+    return KeywordIndex.from_frame(read_report(file, KEYWORD_COLUMNS, skiprows=skiprows))
+
+def read_keyword_index(file, skiprows=2, cache=None):
+    """
+    KeywordIndex of a keyword report, reusing the cached index when the same
+    bytes were seen before; the keyword rows are never kept
+    """
+    if cache is None:
+        if isinstance(file, str):
+            size = os.path.getsize(file)
+        else:
+            size = getattr(file, 'size', None) or len(file.getvalue())
+        return _index_keywords(file, size, skiprows)
+    
+    if hasattr(file, 'getvalue'):
+        data = file.getvalue()
+    else:
+        with open(file, 'rb') as f:
+            data = f.read()
+    key = ParseCache.make_key(data, kind='keyword_index', csv=is_csv(file), skiprows=skiprows, keys='int64')
+    frame = cache.get(key)
+    if frame is not None:
+        return KeywordIndex.from_index_frame(frame)
+    
+    buffer = io.BytesIO(data)
+    buffer.name = file if isinstance(file, str) else getattr(file, 'name', '')
+    keyword_index = _index_keywords(buffer, len(data), skiprows)
+    cache.put(key, keyword_index.to_frame())
+    return keyword_index
+
+REPORT_EXTENSIONS = ('.xlsx', '.csv')
+
+def list_report_files(path):
+    """
+    A report path is either one file or a directory of report files
+    """
+    if os.path.isdir(path):
+        return sorted(
+            os.path.join(path, name) for name in os.listdir(path)
+            if name.lower().endswith(REPORT_EXTENSIONS) and not name.startswith('~$')
+        )
+    return [path]
+
+def read_report_path(path, columns, include_creatives=False, cache=None, visible_only=False):
+    """
+    Read a report file, or every report in a directory stacked into one frame
+    """
+    frames = [
+        read_report_cached(file, columns, include_creatives, cache=cache, visible_only=visible_only)
+        for file in list_report_files(path)
+    ]
+    if not frames:
+        raise ValueError(f"No .xlsx or .csv reports found in {path}")
+    if len(frames) == 1:
+        return frames[0]
+    df = pd.concat(frames, ignore_index=True)
+    # pd.concat only keeps attrs that all frames share
+    unparsed = {}
+    for frame in frames:
+        for col, ids in frame.attrs.get(UNPARSED_IDS, {}).items():
+            unparsed.setdefault(col, {}).update(dict.fromkeys(ids))
+    if unparsed:
+        df.attrs[UNPARSED_IDS] = {col: list(ids) for col, ids in unparsed.items()}
+    return df
+
+def read_keyword_index_path(path, cache=None):
+    """
+    KeywordIndex of a keyword report file, or of every report in a directory
+    """
+    indexes = [read_keyword_index(file, cache=cache) for file in list_report_files(path)]
+    if not indexes:
+        raise ValueError(f"No .xlsx or .csv reports found in {path}")
+    if len(indexes) == 1:
+        return indexes[0]
+    return KeywordIndex.combine(indexes)
+
+# Summary cube: result rows counted per account, campaign and matched pattern
+CUBE_DIMENSIONS = ['Customer ID', 'Account name', 'Campaign', 'Deal type']
+CUBE_MEASURES = ['records', 'valid_records', 'ads_active', 'ads_not_active', 'keywords_active', 'keywords_not_active']
+
+def build_summary_cube(result_df):
+    """
+    Result rows aggregated once per run by CUBE_DIMENSIONS: how many rows
+    there are, how many are valid ad groups and how many have active / not
+    active ads and keywords
+
+    The cube has one row per account, campaign and deal type combination, so
+    summary metrics and breakdowns are read from it instead of the results
+    table. A missing deal type (placeholder rows, unmatched ad groups) is a
+    group of its own.
+    """
+    valid = ~result_df['Ad group'].isin([NO_ADGROUPS_FOUND, NO_VALID_STRUCTURE]).to_numpy()
+    ads = (result_df['ads'] == 'active').to_numpy()
+    keywords = (result_df['keywords'] == 'active').to_numpy()
+    frame = result_df[CUBE_DIMENSIONS].assign(
+        records=1,
+        valid_records=valid,
+        ads_active=ads,
+        ads_not_active=~ads,
+        keywords_active=keywords,
+        keywords_not_active=~keywords
+    )
+    cube = frame.groupby(CUBE_DIMENSIONS, observed=True, dropna=False, sort=False)[CUBE_MEASURES].sum()
+    return cube.astype('int64').reset_index()
+
+def cube_totals(cube, by=None):
+    """
+    The cube's measures summed over all rows (a Series), or per value of the
+    by dimension(s), largest first
+    """
+    if by is None:
+        return cube[CUBE_MEASURES].sum()
+    totals = cube.groupby(by, observed=True, dropna=False, sort=False)[CUBE_MEASURES].sum()
+    return totals.sort_values('records', ascending=False, kind='stable')
+
+def summarize_results(result_df, cube=None):
+    """
+    Overall summary metrics of a results table, read from its summary cube
+    """
+    if cube is None:
+        cube = build_summary_cube(result_df)
+    totals = cube_totals(cube)
+    return {
+        'total_records': int(totals['records']),
+        'active_ads': int(totals['ads_active']),
+        'active_keywords': int(totals['keywords_active']),
+        'accounts': int(cube['Customer ID'].nunique()),
+        'accounts_with_valid_ad_groups': int(cube.loc[cube['valid_records'] > 0, 'Customer ID'].nunique())
+    }
+
+def _analyze_shard(accounts_df, adgroup_df, keyword_index):
+    return build_results(accounts_df, None, adgroup_df, keyword_index)
+
+def _account_shards(accounts_df, adgroup_df, count):
+    """
+    Split the listed accounts into up to count contiguous shards, each with
+    the ad group rows of its own accounts
+
+    Yields (accounts, ad group rows) in account order; build_results over the
+    shards, concatenated, equals a single build_results call.
+    """
+    account_keys = id_keys(accounts_df['Customer ID'])
+    first = (account_keys != MISSING_KEY) & ~pd.Series(account_keys).duplicated().to_numpy()
+    accounts = accounts_df[first]
+    position = pd.Index(account_keys[first]).get_indexer(id_keys(adgroup_df['Customer ID']))
+    for shard in np.array_split(np.arange(len(accounts)), max(1, min(count, len(accounts)))):
+        if len(shard) == 0:
+            continue
+        yield accounts.iloc[shard], adgroup_df[(position >= shard[0]) & (position <= shard[-1])]
+
+# Accounts per progress step when build_results_in_shards splits a run
+PROGRESS_SHARD_ACCOUNTS = 500
+PROGRESS_MAX_SHARDS = 20
+
+def build_results_in_shards(accounts_df, adgroup_df, keyword_index, profiler=None, progress=None):
+    """
+    build_results over contiguous shards of accounts, one after another,
+    calling progress(accounts done, accounts total) after each shard
+
+    Gives a long run points to report progress and to stop at (progress may
+    raise). The output equals a single build_results call; the stages of all
+    shards are summed into profiler.
+    """
+    if 'Customer ID' not in accounts_df.columns or 'Customer ID' not in adgroup_df.columns:
+        return build_results(accounts_df, None, adgroup_df, keyword_index, profiler)
+    
+    account_keys = id_keys(accounts_df['Customer ID'])
+    total = int(pd.unique(account_keys[account_keys != MISSING_KEY]).size)
+    count = min(PROGRESS_MAX_SHARDS, -(-total // PROGRESS_SHARD_ACCOUNTS))
+    shards = []
+    done = 0
+    for shard_accounts, shard_adgroups in _account_shards(accounts_df, adgroup_df, count):
+        shard_profiler = profiler.child() if profiler is not None else None
+        shards.append(build_results(shard_accounts, None, shard_adgroups, keyword_index, shard_profiler))
+        if profiler is not None:
+            profiler.merge(shard_profiler)
+        done += len(shard_accounts)
+        if progress is not None:
+            progress(done, total)
+    if not shards:
+        return build_results(accounts_df, None, adgroup_df, keyword_index, profiler)
+    return pd.concat(shards, ignore_index=True)
+
+def run_analysis(accounts_df, keyword_df, adgroup_df, workers=1, keyword_index=None):
+    """
+    build_results with the accounts split into contiguous shards processed
+    on a pool of worker processes
+    
+    Each worker only receives the ad group rows of its own accounts; shards
+    are concatenated in account order, so the output equals a single run.
+    """
+    if keyword_index is None:
+        keyword_index = KeywordIndex.from_frame(keyword_df)
+    if workers <= 1 or 'Customer ID' not in accounts_df.columns or 'Customer ID' not in adgroup_df.columns:
+        return build_results(accounts_df, None, adgroup_df, keyword_index)
+    
+    shards = list(_account_shards(accounts_df, adgroup_df, workers))
+    if len(shards) < 2:
+        return build_results(accounts_df, None, adgroup_df, keyword_index)
+    
+    with ProcessPoolExecutor(max_workers=len(shards)) as executor:
+        futures = [executor.submit(_analyze_shard, shard_accounts, shard_adgroups, keyword_index) for shard_accounts, shard_adgroups in shards]
+        return pd.concat([future.result() for future in futures], ignore_index=True)
+
+
+# Column naming the ad report each result row came from when several are analyzed
+SOURCE_FILE_COLUMN = 'Source file'
+
+# File name words that only say which kind of report a file is
+REPORT_NAME_WORDS = {'ad', 'ads', 'adgroup', 'group', 'keyword', 'keywords', 'kw', 'kws', 'search', 'report', 'reports'}
+
+def report_buffer(name, data):
+    """
+    In-memory report file that the readers recognise by name
+    """
+    buffer = io.BytesIO(data)
+    buffer.name = name
+    return buffer
+
+def expand_report_files(files):
+    """
+    (file name, bytes) of every report among uploaded files or paths, with
+    the .xlsx / .csv members of .zip archives unpacked
+    """
+    reports = []
+    for file in files:
+        if isinstance(file, str):
+            name = file
+            with open(file, 'rb') as f:
+                data = f.read()
+        else:
+            name = getattr(file, 'name', '')
+            data = file.getvalue()
+        
+        if not name.lower().endswith('.zip'):
+            reports.append((os.path.basename(name), data))
+            continue
+        with zipfile.ZipFile(io.BytesIO(data)) as archive:
+            for member in archive.infolist():
+                member_name = os.path.basename(member.filename)
+                if (
+                    member.is_dir() or member_name.startswith(('~$', '._')) or
+                    not member_name.lower().endswith(REPORT_EXTENSIONS)
+                ):
+                    continue
+                reports.append((member_name, archive.read(member)))
+    return reports
+
+def _pair_key(name):
+    """
+    File name without its extension and report-kind words, e.g.
+    'MCC1 - Ad report.xlsx' and 'mcc1_keyword_report.xlsx' both give ('mcc1',)
+    """
+    stem = os.path.splitext(name)[0].lower()
+    return tuple(word for word in re.split(r'[^a-z0-9]+', stem) if word and word not in REPORT_NAME_WORDS)
+
+def pair_reports(adgroup_reports, keyword_reports):
+    """
+    Match every ad report with the keyword report of the same MCC
+
+    A single keyword report goes with every ad report. Otherwise files are
+    matched by name with the report-kind words removed; reports that do not
+    match one to one raise ValueError rather than being paired by guess.
+    """
+    if not adgroup_reports or not keyword_reports:
+        raise ValueError("At least one ad report and one keyword report are needed")
+    if len(keyword_reports) == 1:
+        return [(adgroup_report, keyword_reports[0]) for adgroup_report in adgroup_reports]
+    
+    keyword_by_key = {}
+    for keyword_report in keyword_reports:
+        keyword_by_key.setdefault(_pair_key(keyword_report[0]), []).append(keyword_report)
+    adgroup_keys = [_pair_key(adgroup_report[0]) for adgroup_report in adgroup_reports]
+    if len(set(adgroup_keys)) == len(adgroup_keys) and all(len(keyword_by_key.get(key, [])) == 1 for key in adgroup_keys):
+        return [(adgroup_report, keyword_by_key[key][0]) for adgroup_report, key in zip(adgroup_reports, adgroup_keys)]
+    raise ValueError(
+        "Could not match the ad reports with the keyword reports; name each pair alike, "
+        "e.g. 'mcc1_ad_report.xlsx' and 'mcc1_keyword_report.xlsx'"
+    )
+
+def _analyze_report_pair(accounts_df, adgroup_report, keyword_report, cache_dir=None):
+    """
+    Parse one (name, bytes) ad report / keyword report pair and analyze the
+    listed accounts that appear in the ad report
+
+    Returns (result_df, account analysis, ad rows per Customer ID, file info).
+    """
+    cache = None
+    if cache_dir:
+        cache = ParseCache(max_memory_bytes=0, cache_dir=cache_dir, max_disk_bytes=2048 * 1024 * 1024)
+    adgroup_df = read_report_cached(report_buffer(*adgroup_report), ADGROUP_COLUMNS, True, cache=cache)
+    keyword_index = read_keyword_index(report_buffer(*keyword_report), cache=cache)
+    add_ads_active_column(adgroup_df)
+    
+    if 'Customer ID' in adgroup_df.columns:
+        ad_rows = adgroup_df['Customer ID'].value_counts()
+        covered = accounts_df[pd.Series(id_keys(accounts_df['Customer ID'])).isin(ad_rows.index).to_numpy()]
+    else:
+        covered = accounts_df.iloc[:0]
+        ad_rows = pd.Series(dtype='int64')
+    result_df = build_results(covered, None, adgroup_df, keyword_index)
+    account_analysis = build_account_analysis(result_df, adgroup_df, keyword_index)
+    result_df[SOURCE_FILE_COLUMN] = adgroup_report[0]
+    info = {
+        'ad_report': adgroup_report[0],
+        'keyword_report': keyword_report[0],
+        'ad_rows': len(adgroup_df),
+        'keyword_rows': keyword_index.keyword_rows
+    }
+    return result_df, account_analysis, ad_rows, info
+
+def _merge_account_analysis(analyses):
+    """
+    build_account_analysis results of several report pairs as one: an ad
+    group found in more than one ad report is listed once, with its ads and
+    keywords counted across the reports and active if it is active in any
+    """
+    merged = {}
+    for account_analysis in analyses:
+        for account, adgroup_analysis in account_analysis.items():
+            entries = merged.setdefault(account, {})
+            for analysis in adgroup_analysis:
+                entry = entries.get(analysis['ad_group'])
+                if entry is None:
+                    entries[analysis['ad_group']] = dict(analysis)
+                    continue
+                entry['ads_count'] += analysis['ads_count']
+                entry['keywords_count'] += analysis['keywords_count']
+                for status in ('ads_status', 'keywords_status'):
+                    if analysis[status] == 'active':
+                        entry[status] = 'active'
+    return {account: list(entries.values()) for account, entries in merged.items()}
+
+def run_report_pairs(accounts_df, pairs, workers=1, cache_dir=None, progress=None):
+    """
+    Analyze every (ad report, keyword report) pair from pair_reports, one
+    pair per worker process, and merge the results
+
+    Accounts keep the accounts list order; an account found in several ad
+    reports gets the rows of each, tagged with SOURCE_FILE_COLUMN, and a
+    single 'No valid structure' row only if none of them has a valid ad group.
+    Listed accounts that are in none of the ad reports get their 'No ad groups
+    found' row. Returns (result_df, account analysis, ad rows per Customer ID, list of
+    file info dicts). progress(pairs done, pairs total) is called as each pair
+    finishes; if it raises, pairs that have not started are dropped and the
+    pairs already running are waited for, so a cancelled job never leaves
+    worker processes busy behind it.
+    """
+    if 'Customer ID' not in accounts_df.columns:
+        raise ValueError("'Customer ID' column not found in accounts_list.xlsx")
+    
+    if workers <= 1 or len(pairs) == 1:
+        outputs = []
+        for adgroup_report, keyword_report in pairs:
+            outputs.append(_analyze_report_pair(accounts_df, adgroup_report, keyword_report, cache_dir))
+            if progress is not None:
+                progress(len(outputs), len(pairs))
+    else:
+        # Jobs call this from a thread of the multi-threaded app server, where forking
+        # can copy a lock held by another thread into the child; spawn starts clean workers
+        executor = ProcessPoolExecutor(
+            max_workers=min(workers, len(pairs)),
+            mp_context=multiprocessing.get_context('spawn')
+        )
+        try:
+            futures = [
+                executor.submit(_analyze_report_pair, accounts_df, adgroup_report, keyword_report, cache_dir)
+                for adgroup_report, keyword_report in pairs
+            ]
+            for done, _ in enumerate(as_completed(futures), 1):
+                if progress is not None:
+                    progress(done, len(pairs))
+            outputs = [future.result() for future in futures]
+        except BaseException:
+            # Drop the pairs still queued; a running pair cannot be interrupted
+            executor.shutdown(wait=True, cancel_futures=True)
+            raise
+        executor.shutdown()
+    
+    # An account keeps its 'no valid structure' row only when no ad report gives it a
+    # valid ad group, and only from the first report that has it, as in a single run
+    results = [output[0] for output in outputs]
+    valid_ids = pd.concat(
+        [result['Customer ID'][result['Ad group'] != NO_VALID_STRUCTURE] for result in results], ignore_index=True
+    )
+    placed = set(valid_ids)
+    for idx, result in enumerate(results):
+        placeholder = (result['Ad group'] == NO_VALID_STRUCTURE).to_numpy()
+        duplicate = placeholder & result['Customer ID'].isin(placed).to_numpy()
+        placed.update(result['Customer ID'][placeholder])
+        if duplicate.any():
+            results[idx] = result[~duplicate].reset_index(drop=True)
+    
+    account_keys = id_keys(accounts_df['Customer ID'])
+    covered = pd.concat([result['Customer ID'] for result in results], ignore_index=True)
+    missing = accounts_df[~pd.Series(account_keys).isin(covered).to_numpy()]
+    placeholders = build_results(missing, None, pd.DataFrame(), KeywordIndex.from_frame(None))
+    placeholders[SOURCE_FILE_COLUMN] = None
+    
+    # Stable sort keeps pair order within an account
+    result_df = pd.concat(results + [placeholders], ignore_index=True)
+    accounts = pd.unique(account_keys[account_keys != MISSING_KEY])
+    order = pd.Index(accounts).get_indexer(result_df['Customer ID'])
+    result_df = result_df.iloc[np.argsort(order, kind='stable')].reset_index(drop=True)
+    
+    # Account analysis in the order the accounts appear in the merged results
+    merged = _merge_account_analysis([output[1] for output in outputs])
+    account_analysis = {account: merged[account] for account in pd.unique(result_df['Account name']) if account in merged}
+    
+    ad_rows = pd.concat([output[2] for output in outputs]).groupby(level=0).sum()
+    return result_df, account_analysis, ad_rows, [output[3] for output in outputs]
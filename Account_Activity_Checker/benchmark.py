@@ -0,0 +1,194 @@
+"""
+Time each stage of the analysis pipeline on synthetic data and record peak memory
+
+Example:
+    python benchmark.py --sizes 10000 100000 1000000 --output bench.json
+    python benchmark.py --sizes 10000 100000 --compare bench.json
+"""
+import argparse
+import gc
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import pandas as pd
+
+from analysis import (
+    ADGROUP_COLUMNS,
+    KEYWORD_COLUMNS,
+    KeywordIndex,
+    build_account_analysis,
+    build_results,
+    check_ads_active,
+    pattern_registry,
+    read_report,
+    stream_keyword_index
+)
+from synthetic_data import generate_reports_for_rows, write_report
+
+DEFAULT_SIZES = [10_000, 100_000, 1_000_000]
+
+def measure(func, repeat):
+    """
+    Best wall-clock time of repeat runs, then one traced run for peak memory
+
+    Timing runs are not traced because tracemalloc slows down allocation-heavy
+    code. Returns (seconds, peak_mb, result).
+    """
+    best = None
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    gc.collect()
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return best, peak / (1024 * 1024), result
+
+def pipeline_stages(accounts_df, keyword_df, adgroup_df, report_dir, excel_rows):
+    """
+    (stage name, callable) pairs; later stages use the results of earlier ones
+    """
+    state = {}
+    ad_rows = len(adgroup_df)
+
+    def ads_active():
+        state['ads_active'] = check_ads_active(adgroup_df)
+        return state['ads_active']
+
+    def keyword_index():
+        state['keyword_index'] = KeywordIndex.from_frame(keyword_df)
+        return state['keyword_index']
+
+    def results():
+        frame = adgroup_df.assign(**{'Ads active': state['ads_active']})
+        state['results'] = build_results(accounts_df, None, frame, state['keyword_index'])
+        return state['results']
+
+    def account_analysis():
+        return build_account_analysis(state['results'], adgroup_df, state['keyword_index'])
+
+    stages = []
+    if report_dir is not None:
+        fmt = 'xlsx' if ad_rows <= excel_rows else 'csv'
+        ad_path = os.path.join(report_dir, f'ad_report.{fmt}')
+        keyword_path = os.path.join(report_dir, f'keyword_report.{fmt}')
+        write_report(adgroup_df, ad_path, 'Ad report')
+        write_report(keyword_df, keyword_path, 'Search keyword report')
+        stages += [
+            (f'read_ad_report_{fmt}', lambda: read_report(ad_path, ADGROUP_COLUMNS, include_creatives=True)),
+            (f'read_keyword_report_{fmt}', lambda: read_report(keyword_path, KEYWORD_COLUMNS)),
+            (f'stream_keyword_index_{fmt}', lambda: stream_keyword_index(keyword_path))
+        ]
+    stages += [
+        ('pattern_match', lambda: pattern_registry.match(adgroup_df['Ad group'])),
+        ('ads_active', ads_active),
+        ('keyword_index', keyword_index),
+        ('build_results', results),
+        ('account_analysis', account_analysis)
+    ]
+    return stages
+
+def run_benchmarks(sizes, repeat=3, include_io=True, excel_rows=100_000, seed=0):
+    """
+    Run every stage at every size; returns a list of result dicts
+    """
+    results = []
+    for size in sizes:
+        accounts_df, keyword_df, adgroup_df = generate_reports_for_rows(size, seed=seed)
+        with tempfile.TemporaryDirectory() as report_dir:
+            stages = pipeline_stages(
+                accounts_df, keyword_df, adgroup_df,
+                report_dir if include_io else None, excel_rows
+            )
+            for stage, func in stages:
+                seconds, peak_mb, _ = measure(func, repeat)
+                results.append({
+                    'stage': stage,
+                    'rows': size,
+                    'keyword_rows': len(keyword_df),
+                    'accounts': len(accounts_df),
+                    'seconds': round(seconds, 4),
+                    'peak_mb': round(peak_mb, 1)
+                })
+                print(f"{stage:<28} {size:>10,} rows  {seconds:9.3f}s  {peak_mb:9.1f} MB", flush=True)
+    return results
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+def compare(results, baseline, threshold):
+    """
+    Print time and memory ratios against a previous run
+
+    Returns the (stage, rows) pairs that got slower than threshold times the baseline.
+    """
+    previous = {(entry['stage'], entry['rows']): entry for entry in baseline['results']}
+    regressions = []
+    print(f"\nCompared with {baseline.get('revision', 'unknown')}:")
+    for entry in results:
+        old = previous.get((entry['stage'], entry['rows']))
+        if old is None:
+            continue
+        time_ratio = entry['seconds'] / old['seconds'] if old['seconds'] else float('inf')
+        memory_ratio = entry['peak_mb'] / old['peak_mb'] if old['peak_mb'] else float('inf')
+        flag = ''
+        if time_ratio > threshold:
+            flag = '  <-- slower'
+            regressions.append((entry['stage'], entry['rows']))
+        print(f"{entry['stage']:<28} {entry['rows']:>10,} rows  time x{time_ratio:5.2f}  memory x{memory_ratio:5.2f}{flag}")
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the analysis pipeline")
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES, help="ad report rows per run")
+    parser.add_argument('--repeat', type=int, default=3, help="timed runs per stage (best is kept)")
+    parser.add_argument('--no-io', action='store_true', help="skip the report reading stages")
+    parser.add_argument('--excel-rows', type=int, default=100_000,
+                        help="largest size read back from .xlsx; bigger sizes use .csv")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="write the results as JSON")
+    parser.add_argument('--compare', help="JSON from an earlier run to compare against")
+    parser.add_argument('--threshold', type=float, default=1.25,
+                        help="time ratio above which a stage counts as a regression")
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(args.sizes, args.repeat, not args.no_io, args.excel_rows, args.seed)
+    report = {
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'repeat': args.repeat,
+        'seed': args.seed,
+        'results': results
+    }
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)
+        if compare(results, baseline, args.threshold):
+            return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
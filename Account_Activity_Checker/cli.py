@@ -0,0 +1,117 @@
+"""
+Run the ad group structure & status analysis without Streamlit
+
+Example:
+    python cli.py --accounts accounts_list.xlsx --keywords keyword_report.xlsx \
+        --ads ad_report.xlsx --output-dir out --workers 8
+    python cli.py --accounts accounts_list.xlsx --keywords keyword_report.xlsx \
+        --ads ad_report.xlsx --output-dir out --state-dir state
+    python cli.py --accounts accounts_list.xlsx --keywords keyword_report.xlsx \
+        --ads ad_report.xlsx --output-dir out --history-db run_history.db
+"""
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import time
+
+from analysis import (
+    ACCOUNTS_COLUMNS,
+    ADGROUP_COLUMNS,
+    PATTERNS_CONFIG_ERROR,
+    ParseCache,
+    read_keyword_index_path,
+    format_customer_ids,
+    read_report_path,
+    run_analysis,
+    summarize_results,
+    unparsed_accounts_message
+)
+from history import RunHistory
+from incremental import load_state, run_incremental, save_state, state_lock
+
+RESULTS_FILE = 'google_ads_activity_report.csv'
+SUMMARY_FILE = 'summary.json'
+CHANGES_FILE = 'status_changes.csv'
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Ad Group Structure & Status Analysis Tool (batch mode)")
+    parser.add_argument('--accounts', required=True, help="accounts_list report, or a directory of them")
+    parser.add_argument('--keywords', required=True, help="keyword_report, or a directory of them")
+    parser.add_argument('--ads', required=True, help="ad_report, or a directory of them")
+    parser.add_argument('--output-dir', default='.', help="where the results CSV and summary JSON are written")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help="worker processes the accounts are sharded across (default: all cores)")
+    parser.add_argument('--cache-dir', default=None,
+                        help="keep parsed reports as Parquet here so unchanged files are not parsed again")
+    parser.add_argument('--state-dir', default=None,
+                        help="keep this run's results here and only re-process accounts that changed since the last run")
+    parser.add_argument('--history-db', default=None,
+                        help="also record this run in the SQLite run-history database at this path")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    if PATTERNS_CONFIG_ERROR:
+        print(PATTERNS_CONFIG_ERROR, file=sys.stderr)
+
+    cache = None
+    if args.cache_dir:
+        cache = ParseCache(max_memory_bytes=0, cache_dir=args.cache_dir, max_disk_bytes=2048 * 1024 * 1024)
+
+    start_time = time.time()
+    try:
+        accounts_df = read_report_path(args.accounts, ACCOUNTS_COLUMNS, cache=cache, visible_only=True)
+        keyword_index = read_keyword_index_path(args.keywords, cache=cache)
+        adgroup_df = read_report_path(args.ads, ADGROUP_COLUMNS, include_creatives=True, cache=cache)
+    except (OSError, ValueError) as e:
+        print(f"Error reading reports: {str(e)}", file=sys.stderr)
+        return 1
+    read_time = time.time() - start_time
+    skipped_accounts = unparsed_accounts_message(accounts_df)
+    if skipped_accounts:
+        print(skipped_accounts, file=sys.stderr)
+
+    start_time = time.time()
+    status_changes = None
+    try:
+        if args.state_dir:
+            # Other runs using the same state directory wait until this one has saved
+            with state_lock(args.state_dir):
+                result_df, run_state, status_changes = run_incremental(
+                    accounts_df, adgroup_df, keyword_index, load_state(args.state_dir)
+                )
+                save_state(run_state, args.state_dir)
+        else:
+            result_df = run_analysis(accounts_df, None, adgroup_df, workers=args.workers, keyword_index=keyword_index)
+    except ValueError as e:
+        print(f"Error processing reports: {str(e)}", file=sys.stderr)
+        return 1
+    processing_time = time.time() - start_time
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    # Customer IDs are keys inside the analysis and written in the 123-456-7890 form
+    output = result_df.assign(**{'Customer ID': format_customer_ids(result_df['Customer ID'])})
+    output.to_csv(os.path.join(args.output_dir, RESULTS_FILE), index=False)
+
+    summary = summarize_results(result_df)
+    summary['read_time'] = round(read_time, 2)
+    summary['processing_time'] = round(processing_time, 2)
+    if status_changes is not None:
+        status_changes.to_csv(os.path.join(args.output_dir, CHANGES_FILE), index=False)
+        summary['reprocessed_accounts'] = len(status_changes)
+        summary['status_changes'] = int(status_changes['status changed'].sum())
+    if args.history_db:
+        try:
+            summary['history_run_id'] = RunHistory(args.history_db).record_run(result_df, source=args.ads)
+        except sqlite3.Error as e:
+            print(f"Error recording run history: {str(e)}", file=sys.stderr)
+    with open(os.path.join(args.output_dir, SUMMARY_FILE), 'w', encoding='utf-8') as f:
+        json.dump(summary, f, indent=2)
+
+    print(json.dumps(summary, indent=2))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,181 @@
+"""
+Write the analysis results as CSV, Parquet or a multi-sheet XLSX workbook, in chunks
+"""
+import os
+import tempfile
+import time
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from openpyxl import Workbook
+
+from analysis import ANALYSIS_COLUMNS, NO_ADGROUPS_FOUND, NO_VALID_STRUCTURE
+
+# Format -> (label, file name, MIME type)
+EXPORT_FORMATS = {
+    'csv': ('CSV', 'google_ads_activity_report.csv', 'text/csv'),
+    'parquet': ('Parquet', 'google_ads_activity_report.parquet', 'application/vnd.apache.parquet'),
+    'xlsx': ('Excel', 'google_ads_activity_report.xlsx',
+             'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
+}
+
+# Export files go to their own directory; files older than EXPORT_MAX_AGE_HOURS
+# (e.g. of sessions that ended) are deleted whenever a new export is written
+EXPORT_DIR = os.environ.get('EXPORT_DIR') or os.path.join(tempfile.gettempdir(), 'google_ads_activity_exports')
+EXPORT_MAX_AGE_SECONDS = float(os.environ.get('EXPORT_MAX_AGE_HOURS', 6)) * 3600
+EXPORT_PREFIX = 'google_ads_activity_'
+
+# Rows converted and written at a time
+EXPORT_CHUNK_ROWS = 50_000
+
+# Data rows per Excel sheet (one row is taken by the header)
+EXCEL_MAX_ROWS = 1_048_575
+
+DRILLDOWN_COLUMNS = {
+    'account': 'Account name',
+    'ad_group': 'Ad group',
+    'campaign': 'Campaign',
+    'ads_status': 'Ads status',
+    'ads_count': 'Ads count',
+    'keywords_status': 'Keywords status',
+    'keywords_count': 'Keywords count'
+}
+
+def drilldown_frame(account_analysis):
+    """
+    build_account_analysis flattened to one row per account and ad group
+    """
+    rows = [
+        (account, *(analysis[col] for col in ANALYSIS_COLUMNS))
+        for account, adgroup_analysis in account_analysis.items()
+        for analysis in adgroup_analysis
+    ]
+    return pd.DataFrame(rows, columns=['account'] + ANALYSIS_COLUMNS).rename(columns=DRILLDOWN_COLUMNS)
+
+def account_summary(result_df, drilldown):
+    """
+    One row per account with the Account Summary figures of the drill-down
+    """
+    accounts = result_df[['Account name', 'Customer ID']].astype(object).drop_duplicates('Customer ID')
+    valid = ~result_df['Ad group'].isin([NO_ADGROUPS_FOUND, NO_VALID_STRUCTURE])
+    accounts['Result rows'] = accounts['Customer ID'].map(
+        result_df.loc[valid, 'Customer ID'].astype(object).value_counts()
+    ).fillna(0).astype('int64')
+
+    grouped = drilldown.assign(
+        ads_active=drilldown['Ads status'] == 'active',
+        keywords_active=drilldown['Keywords status'] == 'active'
+    ).groupby('Account name', sort=False)
+    figures = pd.DataFrame({
+        'Unique ad groups': grouped.size(),
+        'Total ads count': grouped['Ads count'].sum(),
+        'Ad groups with active ads': grouped['ads_active'].sum(),
+        'Ad groups with active keywords': grouped['keywords_active'].sum(),
+        'Keywords count': grouped['Keywords count'].sum()
+    })
+    # With an empty drill-down the joined figures are object columns of NaN
+    summary = accounts.join(figures, on='Account name').infer_objects()
+    return summary.fillna({col: 0 for col in figures.columns}).astype({col: 'int64' for col in figures.columns})
+
+def _chunks(frame, chunksize):
+    for start in range(0, len(frame), chunksize):
+        yield frame.iloc[start:start + chunksize]
+
+def write_csv(result_df, path, chunksize=EXPORT_CHUNK_ROWS):
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        # The header is written even when there are no rows
+        result_df.iloc[:0].to_csv(f, index=False)
+        for chunk in _chunks(result_df, chunksize):
+            chunk.to_csv(f, index=False, header=False)
+
+def write_parquet(result_df, path, chunksize=EXPORT_CHUNK_ROWS):
+    # One schema for the whole frame so that chunks with only empty values still match
+    schema = pa.Schema.from_pandas(result_df, preserve_index=False)
+    with pq.ParquetWriter(path, schema) as writer:
+        for chunk in _chunks(result_df, chunksize):
+            writer.write_table(pa.Table.from_pandas(chunk, schema=schema, preserve_index=False))
+
+def _append_rows(workbook, title, frame, chunksize):
+    """
+    Add frame as one or more write-only sheets (Excel caps the rows per sheet)
+    """
+    sheet = None
+    sheet_rows = 0
+    sheet_count = 0
+    for chunk in _chunks(frame, chunksize):
+        chunk = chunk.astype(object).where(chunk.notna(), None)
+        for row in chunk.itertuples(index=False, name=None):
+            if sheet is None or sheet_rows == EXCEL_MAX_ROWS:
+                sheet_count += 1
+                sheet = workbook.create_sheet(title if sheet_count == 1 else f'{title} {sheet_count}')
+                sheet.append(list(frame.columns))
+                sheet_rows = 0
+            sheet.append(list(row))
+            sheet_rows += 1
+    if sheet is None:
+        workbook.create_sheet(title).append(list(frame.columns))
+
+def write_xlsx(result_df, account_analysis, path, chunksize=EXPORT_CHUNK_ROWS):
+    """
+    Workbook with the results, a per-account summary and the per-ad-group drill-down
+    """
+    drilldown = drilldown_frame(account_analysis)
+    workbook = Workbook(write_only=True)
+    _append_rows(workbook, 'Results', result_df, chunksize)
+    _append_rows(workbook, 'Account summary', account_summary(result_df, drilldown), chunksize)
+    _append_rows(workbook, 'Ad groups', drilldown, chunksize)
+    workbook.save(path)
+
+def remove_stale_exports(directory=EXPORT_DIR, max_age=EXPORT_MAX_AGE_SECONDS):
+    """
+    Delete export files in directory last modified more than max_age seconds ago
+    """
+    if not os.path.isdir(directory):
+        return
+    cutoff = time.time() - max_age
+    for name in os.listdir(directory):
+        if not name.startswith(EXPORT_PREFIX):
+            continue
+        path = os.path.join(directory, name)
+        try:
+            if os.path.getmtime(path) < cutoff:
+                os.remove(path)
+        except OSError:
+            # Removed by another process in the meantime
+            pass
+
+def export_results(result_df, account_analysis, fmt, directory=EXPORT_DIR):
+    """
+    Write the results in fmt (a key of EXPORT_FORMATS) to a new file in
+    directory; returns its path
+
+    Stale exports in the directory are removed first.
+    """
+    os.makedirs(directory, exist_ok=True)
+    remove_stale_exports(directory)
+    suffix = os.path.splitext(EXPORT_FORMATS[fmt][1])[1]
+    handle, path = tempfile.mkstemp(prefix=EXPORT_PREFIX, suffix=suffix, dir=directory)
+    os.close(handle)
+    try:
+        if fmt == 'csv':
+            write_csv(result_df, path)
+        elif fmt == 'parquet':
+            write_parquet(result_df, path)
+        else:
+            write_xlsx(result_df, account_analysis, path)
+    except Exception:
+        os.remove(path)
+        raise
+    return path
+
+def remove_exports(exports):
+    """
+    Delete the files of a {format: path} dict of earlier exports
+    """
+    for path in exports.values():
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+    exports.clear()
@@ -0,0 +1,246 @@
+"""
+Run history: every analysis run's results and per-account aggregates kept in a local SQLite database
+"""
+import os
+import sqlite3
+from contextlib import closing
+from datetime import datetime, timezone
+
+import pandas as pd
+
+from analysis import NO_ADGROUPS_FOUND, NO_VALID_STRUCTURE, SOURCE_FILE_COLUMN, format_customer_ids
+
+# Database file; an empty RUN_HISTORY_DB turns the history off
+HISTORY_DB = os.environ.get(
+    'RUN_HISTORY_DB', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'run_history.db')
+) or None
+
+# Oldest runs beyond this many are deleted when a run is recorded
+HISTORY_MAX_RUNS = int(os.environ.get('RUN_HISTORY_MAX_RUNS', 500))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id INTEGER PRIMARY KEY,
+    run_at TEXT NOT NULL,
+    source TEXT,
+    records INTEGER NOT NULL,
+    active_ads INTEGER NOT NULL,
+    active_keywords INTEGER NOT NULL,
+    accounts INTEGER NOT NULL,
+    accounts_active_ads INTEGER NOT NULL,
+    accounts_active_keywords INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS runs_run_at ON runs (run_at);
+
+CREATE TABLE IF NOT EXISTS results (
+    run_id INTEGER NOT NULL,
+    run_at TEXT NOT NULL,
+    customer_id TEXT,
+    account_name TEXT,
+    campaign TEXT,
+    ad_group TEXT,
+    ads_active INTEGER NOT NULL,
+    keywords_active INTEGER NOT NULL,
+    deal_type TEXT,
+    source_file TEXT
+);
+CREATE INDEX IF NOT EXISTS results_customer ON results (customer_id, ad_group, run_at);
+CREATE INDEX IF NOT EXISTS results_ad_group ON results (ad_group, run_at);
+CREATE INDEX IF NOT EXISTS results_run ON results (run_id);
+
+CREATE TABLE IF NOT EXISTS account_runs (
+    run_id INTEGER NOT NULL,
+    run_at TEXT NOT NULL,
+    customer_id TEXT NOT NULL,
+    account_name TEXT,
+    result_rows INTEGER NOT NULL,
+    valid_ad_groups INTEGER NOT NULL,
+    ad_groups_active_ads INTEGER NOT NULL,
+    ad_groups_active_keywords INTEGER NOT NULL,
+    ads_active INTEGER NOT NULL,
+    keywords_active INTEGER NOT NULL,
+    PRIMARY KEY (run_id, customer_id)
+);
+CREATE INDEX IF NOT EXISTS account_runs_customer ON account_runs (customer_id, run_at);
+CREATE INDEX IF NOT EXISTS account_runs_run_at ON account_runs (run_at);
+"""
+
+# Status transitions between an account's consecutive runs. Only the runs in
+# the period and, for each account in them, the account's own last run before
+# the period are windowed (both found through indexes), so the query does not
+# grow with the number of runs kept. Runs may cover different accounts.
+TRANSITIONS_QUERY = """
+WITH recent AS (
+    SELECT run_id, customer_id, account_name, run_at, ads_active, keywords_active
+    FROM account_runs
+    WHERE run_at >= :since
+),
+previous AS (
+    SELECT a.run_id, a.customer_id, a.account_name, a.run_at, a.ads_active, a.keywords_active
+    FROM (SELECT DISTINCT customer_id FROM recent) c
+    JOIN account_runs a ON a.customer_id = c.customer_id AND a.run_at = (
+        SELECT MAX(b.run_at) FROM account_runs b
+        WHERE b.customer_id = c.customer_id AND b.run_at < :since
+    )
+),
+ordered AS (
+    SELECT
+        customer_id, account_name, run_at, ads_active, keywords_active,
+        LAG(run_at) OVER w AS previous_run_at,
+        LAG(ads_active) OVER w AS previous_ads_active,
+        LAG(keywords_active) OVER w AS previous_keywords_active
+    FROM (SELECT * FROM recent UNION ALL SELECT * FROM previous)
+    WINDOW w AS (PARTITION BY customer_id ORDER BY run_at, run_id)
+)
+SELECT
+    customer_id, account_name, previous_run_at, run_at,
+    previous_ads_active, ads_active, previous_keywords_active, keywords_active
+FROM ordered
+WHERE previous_run_at IS NOT NULL AND run_at >= :since AND (
+    (:direction IS NULL AND (ads_active != previous_ads_active OR keywords_active != previous_keywords_active)) OR
+    (:direction = 'deactivated' AND (ads_active < previous_ads_active OR keywords_active < previous_keywords_active)) OR
+    (:direction = 'activated' AND (ads_active > previous_ads_active OR keywords_active > previous_keywords_active))
+)
+ORDER BY run_at DESC, customer_id
+"""
+
+def _status(flags):
+    return flags.map({1: 'active', 0: 'not active'})
+
+def account_aggregates(result_df):
+    """
+    Per Customer ID: result rows, valid ad groups, ad groups with active ads /
+    keywords, and whether the account has any active ads / keywords
+    """
+    valid = ~result_df['Ad group'].isin([NO_ADGROUPS_FOUND, NO_VALID_STRUCTURE]).to_numpy()
+    frame = pd.DataFrame({
+        'customer_id': result_df['Customer ID'].astype(object).to_numpy(),
+        'account_name': result_df['Account name'].astype(object).to_numpy(),
+        'ad_group': result_df['Ad group'].astype(object).where(valid).to_numpy(),
+        'ads': (result_df['ads'] == 'active').to_numpy() & valid,
+        'keywords': (result_df['keywords'] == 'active').to_numpy() & valid
+    })
+    frame = frame[frame['customer_id'].notna()]
+    grouped = frame.groupby('customer_id', sort=False)
+    aggregates = pd.DataFrame({
+        'account_name': grouped['account_name'].first(),
+        'result_rows': grouped.size(),
+        'valid_ad_groups': grouped['ad_group'].nunique(),
+        'ad_groups_active_ads': frame[frame['ads']].groupby('customer_id')['ad_group'].nunique(),
+        'ad_groups_active_keywords': frame[frame['keywords']].groupby('customer_id')['ad_group'].nunique(),
+        'ads_active': grouped['ads'].any(),
+        'keywords_active': grouped['keywords'].any()
+    })
+    counts = ['ad_groups_active_ads', 'ad_groups_active_keywords']
+    aggregates[counts] = aggregates[counts].fillna(0)
+    return aggregates.astype({col: 'int64' for col in aggregates.columns if col != 'account_name'})
+
+class RunHistory:
+    """
+    Results and per-account aggregates of every run in a SQLite database,
+    indexed on Customer ID, Ad group and run timestamp
+
+    Timestamps are UTC ISO strings, so they sort in time order. A connection
+    is opened per call, which keeps the object safe to share between the
+    threads of a Streamlit server.
+    """
+    def __init__(self, path):
+        self.path = path
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        with closing(self._connect()) as conn:
+            conn.executescript(SCHEMA)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.execute('PRAGMA journal_mode=WAL')
+        return conn
+
+    def _query(self, sql, params=()):
+        with closing(self._connect()) as conn:
+            return pd.read_sql_query(sql, conn, params=params)
+
+    def record_run(self, result_df, source=None, run_at=None, max_runs=HISTORY_MAX_RUNS):
+        """
+        Store a run's results and per-account aggregates; returns its run_id
+        """
+        run_at = run_at or datetime.now(timezone.utc).isoformat(timespec='seconds')
+        # Customer IDs are stored in the 123-456-7890 form the app shows
+        result_df = result_df.assign(**{'Customer ID': format_customer_ids(result_df['Customer ID'])})
+        aggregates = account_aggregates(result_df)
+        ads_active = (result_df['ads'] == 'active').to_numpy()
+        keywords_active = (result_df['keywords'] == 'active').to_numpy()
+
+        def text(col):
+            if col not in result_df.columns:
+                return [None] * len(result_df)
+            values = result_df[col].astype(object)
+            return values.where(values.notna(), None).tolist()
+
+        with closing(self._connect()) as conn, conn:
+            cursor = conn.execute(
+                'INSERT INTO runs (run_at, source, records, active_ads, active_keywords, accounts, '
+                'accounts_active_ads, accounts_active_keywords) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (
+                    run_at, source, len(result_df), int(ads_active.sum()), int(keywords_active.sum()),
+                    len(aggregates), int(aggregates['ads_active'].sum()), int(aggregates['keywords_active'].sum())
+                )
+            )
+            run_id = cursor.lastrowid
+            conn.executemany(
+                'INSERT INTO results VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                zip(
+                    [run_id] * len(result_df), [run_at] * len(result_df),
+                    text('Customer ID'), text('Account name'), text('Campaign'), text('Ad group'),
+                    ads_active.astype(int).tolist(), keywords_active.astype(int).tolist(),
+                    text('Deal type'), text(SOURCE_FILE_COLUMN)
+                )
+            )
+            conn.executemany(
+                'INSERT INTO account_runs VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (
+                    (run_id, run_at, customer_id, *row)
+                    for customer_id, row in zip(
+                        aggregates.index.astype(str),
+                        aggregates.astype(object).where(aggregates.notna(), None).itertuples(index=False, name=None)
+                    )
+                )
+            )
+            if max_runs:
+                self._prune(conn, max_runs)
+        return run_id
+
+    @staticmethod
+    def _prune(conn, max_runs):
+        old_runs = 'SELECT run_id FROM runs ORDER BY run_at DESC, run_id DESC LIMIT -1 OFFSET ?'
+        for table in ('results', 'account_runs', 'runs'):
+            conn.execute(f'DELETE FROM {table} WHERE run_id IN ({old_runs})', (max_runs,))
+
+    def runs(self):
+        """
+        One row per run with its totals, oldest first
+        """
+        return self._query('SELECT * FROM runs ORDER BY run_at, run_id')
+
+    def transitions(self, since, direction=None):
+        """
+        Accounts whose ads or keywords status changed between two of their
+        consecutive runs, for runs at or after since (ISO timestamp)
+
+        direction 'deactivated' keeps changes to not active, 'activated'
+        changes to active; None keeps both.
+        """
+        frame = self._query(TRANSITIONS_QUERY, {'since': since, 'direction': direction})
+        for col in ['previous_ads_active', 'ads_active', 'previous_keywords_active', 'keywords_active']:
+            frame[col] = _status(frame[col])
+        return frame
+
+    def account_trend(self, customer_id):
+        """
+        An account's aggregates in every run it was part of, oldest first;
+        customer_id may be written with or without hyphens
+        """
+        return self._query(
+            'SELECT * FROM account_runs WHERE customer_id = ? ORDER BY run_at, run_id',
+            (format_customer_ids([customer_id])[0],)
+        )
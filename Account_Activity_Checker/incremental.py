@@ -0,0 +1,254 @@
+"""
+Incremental re-processing: only accounts whose report rows changed since the last run are recomputed
+"""
+import json
+import os
+import shutil
+import tempfile
+import threading
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+
+from analysis import (
+    MISSING_KEY,
+    NO_ADGROUPS_FOUND,
+    NO_VALID_STRUCTURE,
+    RESULT_COLUMNS,
+    build_results,
+    format_customer_ids,
+    id_keys,
+    pattern_registry
+)
+
+try:
+    import fcntl
+except ImportError:
+    # Windows: runs in one process still take turns, separate processes do not
+    fcntl = None
+
+RESULTS_FILE = 'results.parquet'
+FINGERPRINTS_FILE = 'fingerprints.parquet'
+META_FILE = 'state.json'
+# Each save writes a new run directory; this file names the current one
+POINTER_FILE = 'current'
+RUN_DIR_PREFIX = 'run-'
+LOCK_FILE = '.lock'
+
+# Directory the previous run is kept in between sessions (unset: only within a session)
+RUN_STATE_DIR = os.environ.get('RUN_STATE_DIR') or None
+
+# Odd multiplier that makes the per-account fingerprint depend on row order
+ROW_ORDER_MULTIPLIER = np.uint64(0x9E3779B97F4A7C15)
+
+class RunState:
+    """
+    Results and per-account fingerprints of the previous run
+    """
+    def __init__(self, results, fingerprints, signature):
+        # Result rows of every account seen so far (RESULT_COLUMNS)
+        self.results = results
+        # Series: Customer ID key -> uint64 fingerprint of that account's inputs
+        self.fingerprints = fingerprints
+        # Analysis settings the results were computed with
+        self.signature = signature
+
+def analysis_signature():
+    """
+    Anything besides the report rows that changes the results; a different
+    signature forces a full run
+    """
+    return json.dumps(
+        {'patterns': pattern_registry.patterns, 'columns': RESULT_COLUMNS, 'customer_id': 'int64 key'},
+        sort_keys=True
+    )
+
+def _hash_rows(df):
+    """
+    uint64 hash of each row's values
+    """
+    try:
+        return pd.util.hash_pandas_object(df, index=False).to_numpy()
+    except TypeError:
+        # Columns mixing strings with numbers
+        return pd.util.hash_pandas_object(df.astype(str), index=False).to_numpy()
+
+def fingerprint_accounts(accounts_df, adgroup_df, keyword_index):
+    """
+    One fingerprint per listed Customer ID covering its account name, its ad
+    report rows (in order) and the keyword counts of its ad groups
+    """
+    account_keys = id_keys(accounts_df['Customer ID'])
+    first = (account_keys != MISSING_KEY) & ~pd.Series(account_keys).duplicated().to_numpy()
+    accounts = accounts_df[first]
+    customer_ids = pd.Index(account_keys[first])
+    names = accounts['Account name'] if 'Account name' in accounts.columns else pd.Series("", index=accounts.index)
+    fingerprints = _hash_rows(names.to_frame())
+
+    if 'Customer ID' in adgroup_df.columns and len(adgroup_df) > 0:
+        position = customer_ids.get_indexer(id_keys(adgroup_df['Customer ID']))
+        listed = position >= 0
+        rows = adgroup_df[listed]
+        # Row content plus the keyword count of the row's ad group
+        row_hashes = _hash_rows(rows)
+        if 'Ad group ID' in rows.columns:
+            keyword_counts = keyword_index.count(rows['Ad group ID']).astype(np.uint64)
+            row_hashes = row_hashes ^ pd.util.hash_array(keyword_counts)
+        # Weight each row by its position within the account so reordering counts as a change
+        row_position = position[listed]
+        order = pd.Series(row_position).groupby(row_position).cumcount().to_numpy().astype(np.uint64)
+        np.add.at(fingerprints, row_position, row_hashes * (order * ROW_ORDER_MULTIPLIER + np.uint64(1)))
+    return pd.Series(fingerprints, index=customer_ids, dtype=np.uint64)
+
+def account_status(results):
+    """
+    Per Customer ID key: whether any ad group has active ads / active keywords
+    """
+    valid = results[~results['Ad group'].isin([NO_ADGROUPS_FOUND, NO_VALID_STRUCTURE])]
+    status = pd.DataFrame({
+        'ads': (valid['ads'] == 'active').groupby(valid['Customer ID'], sort=False).any(),
+        'keywords': (valid['keywords'] == 'active').groupby(valid['Customer ID'], sort=False).any()
+    })
+    status = status.reindex(pd.unique(results['Customer ID']), fill_value=False)
+    return status.replace({True: 'active', False: 'not active'})
+
+def run_incremental(accounts_df, adgroup_df, keyword_index, previous=None, profiler=None):
+    """
+    Recompute only the accounts whose fingerprint changed since previous
+
+    Returns (results, state, changes): the full results for the current
+    accounts list in the usual order, the RunState to keep for the next run,
+    and a frame of the recomputed accounts (Customer IDs formatted for
+    display) with their previous and current ads/keywords status and whether
+    it changed.
+    """
+    if 'Customer ID' not in accounts_df.columns:
+        raise ValueError("'Customer ID' column not found in accounts_list.xlsx")
+
+    signature = analysis_signature()
+    fingerprints = fingerprint_accounts(accounts_df, adgroup_df, keyword_index)
+    if previous is None or previous.signature != signature:
+        empty = pd.DataFrame(columns=RESULT_COLUMNS).astype({'Customer ID': 'int64'})
+        previous = RunState(empty, pd.Series(dtype=np.uint64, index=pd.Index([], dtype='int64')), signature)
+
+    known = fingerprints.index.isin(previous.fingerprints.index)
+    old = previous.fingerprints.reindex(fingerprints.index).to_numpy()
+    unchanged = known & (old == fingerprints.to_numpy())
+    changed_ids = fingerprints.index[~unchanged]
+
+    # Only the changed accounts (and their ad report rows) go through the engine
+    changed_accounts = accounts_df[pd.Series(id_keys(accounts_df['Customer ID'])).isin(changed_ids).to_numpy()]
+    changed_adgroups = adgroup_df
+    if 'Customer ID' in adgroup_df.columns:
+        changed_adgroups = adgroup_df[pd.Series(id_keys(adgroup_df['Customer ID'])).isin(changed_ids).to_numpy()]
+    recomputed = build_results(changed_accounts, None, changed_adgroups, keyword_index, profiler)
+
+    # Merge with the stored rows of unchanged accounts, in accounts list order
+    kept = previous.results[previous.results['Customer ID'].isin(fingerprints.index[unchanged])]
+    results = pd.concat([kept, recomputed], ignore_index=True)
+    order = fingerprints.index.get_indexer(results['Customer ID'])
+    results = results.iloc[np.argsort(order, kind='stable')].reset_index(drop=True)
+
+    # Status changes of the recomputed accounts that were seen before
+    current_status = account_status(recomputed)
+    previous_status = account_status(previous.results).reindex(current_status.index)
+    changes = pd.DataFrame({
+        'Customer ID': current_status.index,
+        'previous ads': previous_status['ads'].to_numpy(),
+        'ads': current_status['ads'].to_numpy(),
+        'previous keywords': previous_status['keywords'].to_numpy(),
+        'keywords': current_status['keywords'].to_numpy()
+    })
+    changes['status changed'] = changes['previous ads'].notna() & (
+        (changes['previous ads'] != changes['ads']) | (changes['previous keywords'] != changes['keywords'])
+    )
+    names = recomputed.drop_duplicates('Customer ID').set_index('Customer ID')['Account name']
+    changes.insert(0, 'Account name', names.reindex(changes['Customer ID']).to_numpy())
+    changes['Customer ID'] = format_customer_ids(changes['Customer ID'])
+
+    # Accounts from earlier runs that are not in this list are kept for later runs
+    stale = ~previous.results['Customer ID'].isin(fingerprints.index)
+    state = RunState(
+        pd.concat([previous.results[stale], results], ignore_index=True),
+        pd.concat([previous.fingerprints[~previous.fingerprints.index.isin(fingerprints.index)], fingerprints]),
+        signature
+    )
+    return results, state, changes
+
+# One lock per state directory for the runs of this process
+_state_locks = {}
+_state_locks_guard = threading.Lock()
+
+@contextmanager
+def state_lock(directory):
+    """
+    Held while a run loads, recomputes and saves the state in directory, so
+    runs sharing it (app jobs, CLI runs) take turns instead of mixing their
+    states; across processes through an fcntl lock file where available
+    """
+    path = os.path.abspath(directory)
+    with _state_locks_guard:
+        lock = _state_locks.setdefault(path, threading.Lock())
+    with lock:
+        if fcntl is None:
+            yield
+            return
+        os.makedirs(path, exist_ok=True)
+        with open(os.path.join(path, LOCK_FILE), 'a') as handle:
+            fcntl.flock(handle, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(handle, fcntl.LOCK_UN)
+
+def save_state(state, directory):
+    """
+    Write a RunState to directory (call under state_lock)
+
+    The files go to a new run directory and the pointer to it is replaced in
+    one step, so a reader sees either the previous state or this one, never
+    a mix or a half-written file. Older run directories are then removed.
+    """
+    os.makedirs(directory, exist_ok=True)
+    run_dir = tempfile.mkdtemp(prefix=RUN_DIR_PREFIX, dir=directory)
+    state.results.to_parquet(os.path.join(run_dir, RESULTS_FILE), index=False)
+    fingerprints = pd.DataFrame({
+        'Customer ID': state.fingerprints.index.to_numpy(dtype=np.int64),
+        'fingerprint': state.fingerprints.to_numpy(dtype=np.uint64)
+    })
+    fingerprints.to_parquet(os.path.join(run_dir, FINGERPRINTS_FILE), index=False)
+    with open(os.path.join(run_dir, META_FILE), 'w', encoding='utf-8') as f:
+        json.dump({'signature': state.signature}, f)
+    
+    pointer_tmp = os.path.join(directory, f'{POINTER_FILE}.{os.getpid()}.{threading.get_ident()}.tmp')
+    with open(pointer_tmp, 'w', encoding='utf-8') as f:
+        f.write(os.path.basename(run_dir))
+    os.replace(pointer_tmp, os.path.join(directory, POINTER_FILE))
+    for name in os.listdir(directory):
+        if name.startswith(RUN_DIR_PREFIX) and name != os.path.basename(run_dir):
+            shutil.rmtree(os.path.join(directory, name), ignore_errors=True)
+
+def load_state(directory):
+    """
+    RunState saved in directory, or None if there is none yet
+    """
+    pointer = os.path.join(directory, POINTER_FILE)
+    if os.path.exists(pointer):
+        with open(pointer, encoding='utf-8') as f:
+            run_dir = os.path.join(directory, f.read().strip())
+    else:
+        # State written by earlier versions, directly in directory
+        run_dir = directory
+    paths = [os.path.join(run_dir, name) for name in (RESULTS_FILE, FINGERPRINTS_FILE, META_FILE)]
+    if not all(os.path.exists(path) for path in paths):
+        return None
+    results = pd.read_parquet(paths[0])
+    fingerprints = pd.read_parquet(paths[1])
+    with open(paths[2], encoding='utf-8') as f:
+        signature = json.load(f)['signature']
+    return RunState(
+        results,
+        pd.Series(fingerprints['fingerprint'].to_numpy(dtype=np.uint64), index=pd.Index(fingerprints['Customer ID'])),
+        signature
+    )
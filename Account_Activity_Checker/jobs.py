@@ -0,0 +1,302 @@
+"""
+Background analysis jobs: a bounded pool of worker threads shared by all sessions, with fair queueing, progress and cancellation
+"""
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from contextlib import nullcontext
+
+from profiling import StageProfiler
+from analysis import (
+    ACCOUNTS_COLUMNS,
+    add_ads_active_column,
+    build_account_analysis,
+    build_results_in_shards,
+    build_summary_cube,
+    compact_results,
+    expand_report_files,
+    pair_reports,
+    read_report_cached,
+    read_uploads,
+    report_buffer,
+    run_report_pairs,
+    unparsed_accounts_message
+)
+from incremental import RUN_STATE_DIR, load_state, run_incremental, save_state, state_lock
+
+# Analysis jobs run at the same time on one server; further jobs wait in the queue
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', max(1, (os.cpu_count() or 1) // 2)))
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+
+class JobCancelled(Exception):
+    """
+    Raised inside a job at its next progress report after it was cancelled
+    """
+
+class Job:
+    """
+    One submitted analysis: its status, progress and, once finished, its
+    result or error
+
+    The worker thread updates stage and progress through enter_stage and
+    advance; both raise JobCancelled once the job was cancelled, so a job
+    stops at its next stage, account shard or report pair.
+    """
+    def __init__(self, owner, target, args, kwargs):
+        self.id = uuid.uuid4().hex
+        self.owner = owner
+        self.target = target
+        self.args = args
+        self.kwargs = kwargs
+        self.status = QUEUED
+        # Current stage and (done, total, unit) within the run
+        self.stage = None
+        self.progress = None
+        self.result = None
+        self.error = None
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self._cancel = threading.Event()
+
+    @property
+    def finished(self):
+        return self.status in (DONE, FAILED, CANCELLED)
+
+    @property
+    def cancel_requested(self):
+        return self._cancel.is_set()
+
+    def check_cancelled(self):
+        if self._cancel.is_set():
+            raise JobCancelled()
+
+    def enter_stage(self, name):
+        self.check_cancelled()
+        self.stage = name
+
+    def advance(self, done, total, unit):
+        self.check_cancelled()
+        self.progress = (done, total, unit)
+
+class JobQueue:
+    """
+    Runs jobs on a fixed number of worker threads
+
+    Each owner (a browser session) has its own FIFO queue and the workers
+    take jobs from the owners in turn, so a session that submits several
+    jobs does not hold up the others.
+    """
+    def __init__(self, workers=JOB_WORKERS):
+        self.workers = max(1, workers)
+        self._condition = threading.Condition()
+        # owner -> deque of queued jobs; the first owner is served next
+        self._queues = OrderedDict()
+        self._threads = [
+            threading.Thread(target=self._work, name=f'analysis-job-{i}', daemon=True)
+            for i in range(self.workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, owner, target, *args, **kwargs):
+        """
+        Queue target(job, *args, **kwargs) for owner; returns the Job
+        """
+        job = Job(owner, target, args, kwargs)
+        with self._condition:
+            self._queues.setdefault(owner, deque()).append(job)
+            self._condition.notify()
+        return job
+
+    def cancel(self, job):
+        """
+        Drop a queued job, or ask a running one to stop at its next progress report
+        """
+        job._cancel.set()
+        with self._condition:
+            jobs = self._queues.get(job.owner)
+            if jobs is not None and job in jobs:
+                jobs.remove(job)
+                if not jobs:
+                    del self._queues[job.owner]
+                job.status = CANCELLED
+                job.finished_at = time.time()
+
+    def position(self, job):
+        """
+        Number of queued jobs that will start before job (None once it left the queue)
+        """
+        with self._condition:
+            owners = list(self._queues)
+            if job.owner not in owners or job not in self._queues[job.owner]:
+                return None
+            turn = owners.index(job.owner)
+            rank = self._queues[job.owner].index(job)
+            # Owners are served in turn: those ahead of job's owner in this
+            # round get one more job in before it
+            return sum(
+                min(len(self._queues[owner]), rank + (1 if i < turn else 0))
+                for i, owner in enumerate(owners)
+            )
+
+    def _next_job(self):
+        with self._condition:
+            while not self._queues:
+                self._condition.wait()
+            owner, jobs = next(iter(self._queues.items()))
+            job = jobs.popleft()
+            # The owner goes to the back of the line
+            del self._queues[owner]
+            if jobs:
+                self._queues[owner] = jobs
+            job.status = RUNNING
+            job.started_at = time.time()
+            return job
+
+    def _work(self):
+        while True:
+            job = self._next_job()
+            try:
+                job.check_cancelled()
+                job.result = job.target(job, *job.args, **job.kwargs)
+                job.status = DONE
+            except JobCancelled:
+                job.status = CANCELLED
+            except Exception as e:
+                job.error = e
+                job.status = FAILED
+            finally:
+                job.finished_at = time.time()
+                # The inputs (uploaded files) are not needed any more
+                job.args = job.kwargs = None
+
+def run_analysis_job(job, accounts_file, adgroup_files, keyword_files, cache=None, workers=1,
+                     trace_memory=False, incremental=False, previous_state=None, history=None):
+    """
+    The whole Submit pipeline as a job: pair the reports, parse, analyze,
+    compact, summarize and record the run
+
+    Uploads are passed as in-memory copies (report_buffer) so the job does
+    not touch Streamlit objects. Returns a dict with what the app keeps in
+    session state plus file information and messages to show once.
+    """
+    profiler = StageProfiler(trace_memory=trace_memory, listener=job.enter_stage)
+    messages = []
+    run_state = None
+    status_changes = None
+
+    # Match every ad report (one per MCC) with its keyword report; zip archives are unpacked
+    with profiler.stage('pair_reports') as record:
+        pairs = pair_reports(expand_report_files(adgroup_files), expand_report_files(keyword_files))
+        record['rows'] = len(pairs)
+
+    if len(pairs) == 1:
+        with profiler.stage('parse_reports') as record:
+            # Read the three files in parallel, only the columns the analysis needs
+            # The keyword report is only streamed into a keyword index, never loaded as a table
+            accounts_df, keyword_index, adgroup_df = read_uploads(
+                accounts_file, report_buffer(*pairs[0][1]), report_buffer(*pairs[0][0]),
+                cache, stream_keywords=True
+            )
+            record['rows'] = len(accounts_df) + keyword_index.keyword_rows + len(adgroup_df)
+        skipped_accounts = unparsed_accounts_message(accounts_df)
+        file_lines = [
+            f"**Accounts file:** {accounts_df.shape[0]} rows, {accounts_df.shape[1]} columns",
+            f"**Keywords file:** {keyword_index.keyword_rows} rows, {len(keyword_index)} ad groups",
+            f"**Ad Group file:** {adgroup_df.shape[0]} rows, {adgroup_df.shape[1]} columns"
+        ]
+        file_info = None
+
+        start_time = time.time()
+        with profiler.stage('ads_active_column', len(adgroup_df)):
+            add_ads_active_column(adgroup_df)
+        if incremental:
+            # Unchanged accounts reuse the previous run's rows; jobs sharing
+            # RUN_STATE_DIR take turns so each builds on the state the last one saved
+            with state_lock(RUN_STATE_DIR) if RUN_STATE_DIR else nullcontext():
+                if previous_state is None and RUN_STATE_DIR:
+                    previous_state = load_state(RUN_STATE_DIR)
+                result_df, run_state, status_changes = run_incremental(
+                    accounts_df, adgroup_df, keyword_index, previous_state, profiler
+                )
+                if RUN_STATE_DIR:
+                    save_state(run_state, RUN_STATE_DIR)
+        else:
+            result_df = build_results_in_shards(
+                accounts_df, adgroup_df, keyword_index, profiler,
+                progress=lambda done, total: job.advance(done, total, 'accounts')
+            )
+        end_time = time.time()
+
+        with profiler.stage('account_analysis', len(result_df)):
+            account_analysis = build_account_analysis(result_df, adgroup_df, keyword_index)
+        profiler.record_accounts(adgroup_df, result_df)
+        raw_data = [accounts_df, adgroup_df, keyword_index]
+        del accounts_df, adgroup_df, keyword_index
+    else:
+        if incremental:
+            messages.append("Incremental mode works with a single ad report; all reports are analyzed in full.")
+        with profiler.stage('parse_reports') as record:
+            accounts_df = read_report_cached(accounts_file, ACCOUNTS_COLUMNS, cache=cache, visible_only=True)
+            record['rows'] = len(accounts_df)
+        skipped_accounts = unparsed_accounts_message(accounts_df)
+
+        # Each report pair is parsed and analyzed in its own worker process
+        start_time = time.time()
+        with profiler.stage('analyze_report_pairs') as record:
+            result_df, account_analysis, ad_rows, file_info = run_report_pairs(
+                accounts_df, pairs, workers=workers, cache_dir=cache.cache_dir if cache is not None else None,
+                progress=lambda done, total: job.advance(done, total, 'report pairs')
+            )
+            record['rows'] = sum(info['ad_rows'] for info in file_info)
+        end_time = time.time()
+        file_lines = [f"**Accounts file:** {accounts_df.shape[0]} rows, {accounts_df.shape[1]} columns"]
+        profiler.record_accounts(None, result_df, ad_rows)
+        raw_data = [accounts_df]
+        del accounts_df
+
+    if skipped_accounts:
+        messages.append(skipped_accounts)
+
+    # Only the compact results table and the per-account lookup are kept; the raw reports are not
+    with profiler.stage('compact_results', len(result_df)):
+        results_table = compact_results(result_df)
+
+    # Summary metrics and breakdowns are read from the cube, not the results table
+    with profiler.stage('summary_cube', len(results_table)):
+        summary_cube = build_summary_cube(results_table)
+
+    # Keep the run in the history store for trend queries
+    if history is not None:
+        try:
+            with profiler.stage('record_history', len(result_df)):
+                history.record_run(result_df, source=', '.join(ad_report[0] for ad_report, _ in pairs))
+        except sqlite3.Error as e:
+            messages.append(f"This run could not be saved to the run history: {str(e)}")
+
+    profiler.record_session_memory(
+        raw_data + [result_df, account_analysis],
+        [results_table, summary_cube, account_analysis, run_state]
+    )
+    profiler.listener = None
+    return {
+        'results_table': results_table,
+        'summary_cube': summary_cube,
+        'account_analysis': account_analysis,
+        'processing_time': round(end_time - start_time, 2),
+        'profiler': profiler,
+        'run_state': run_state,
+        'status_changes': status_changes,
+        'file_lines': file_lines,
+        'file_info': file_info,
+        'messages': messages
+    }
@@ -0,0 +1,170 @@
+"""
+Per-stage timing, row count and memory instrumentation for an analysis run
+"""
+import json
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+import pandas as pd
+
+# Large object columns and containers are measured on a sample of this many items
+SAMPLE_ITEMS = 10_000
+SAMPLE_CONTAINER_ITEMS = 1_000
+
+# tracemalloc is process-wide: stages that trace memory run one at a time
+# (across jobs and the script thread) so they do not reset each other's peak
+_TRACE_LOCK = threading.RLock()
+
+def _series_bytes(series):
+    """
+    Memory of a Series; for large object columns the per-element part is
+    extrapolated from an evenly spaced sample
+    """
+    if series.dtype != object or len(series) <= SAMPLE_ITEMS:
+        return int(series.memory_usage(deep=True, index=False))
+    sample = series.iloc[::len(series) // SAMPLE_ITEMS]
+    per_item = (sample.memory_usage(deep=True, index=False) - sample.memory_usage(index=False)) / len(sample)
+    return int(series.memory_usage(index=False) + per_item * len(series))
+
+def estimate_bytes(value, seen=None):
+    """
+    Approximate deep size of a value: DataFrames and Series by their memory
+    usage, containers and plain objects by walking (a sample of) their contents
+    """
+    if seen is None:
+        seen = set()
+    if id(value) in seen:
+        return 0
+    seen.add(id(value))
+    if isinstance(value, pd.DataFrame):
+        return int(value.index.memory_usage(deep=True)) + sum(_series_bytes(value[col]) for col in value.columns)
+    if isinstance(value, pd.Series):
+        return int(value.index.memory_usage(deep=True)) + _series_bytes(value)
+    if isinstance(value, pd.Index):
+        return int(value.memory_usage(deep=True))
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        items = list(value.items())
+    elif isinstance(value, (list, tuple, set)):
+        items = list(value)
+    elif hasattr(value, '__dict__'):
+        return size + estimate_bytes(vars(value), seen)
+    else:
+        return size
+    step = max(1, len(items) // SAMPLE_CONTAINER_ITEMS)
+    sampled = sum(estimate_bytes(item, seen) for item in items[::step])
+    return size + sampled * len(items) // max(1, len(items[::step]))
+
+class StageProfiler:
+    """
+    Records wall time, row counts and, when trace_memory is on, the peak
+    memory allocated by each stage of a run
+
+    Memory is measured with tracemalloc, which slows allocation-heavy code
+    down, so it is opt-in. Stages should not be nested while tracing memory.
+    Traced stages of concurrent runs wait for each other; allocations of
+    untraced work running at the same time still count towards the peak.
+    Recording a stage again (e.g. rendering on a rerun) replaces the old entry.
+    listener, if given, is called with each stage's name as the stage starts
+    (e.g. to report progress); an exception it raises stops the run.
+    """
+    def __init__(self, trace_memory=False, listener=None):
+        self.trace_memory = trace_memory
+        self.listener = listener
+        self.stages = {}
+        self.accounts = None
+        self.session_memory = None
+
+    @contextmanager
+    def stage(self, name, rows=None):
+        """
+        Time the enclosed block; rows can also be set on the yielded record
+        """
+        if self.listener is not None:
+            self.listener(name)
+        record = {'stage': name, 'rows': rows, 'seconds': None, 'peak_mb': None}
+        started_tracing = False
+        if self.trace_memory:
+            _TRACE_LOCK.acquire()
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                started_tracing = True
+            tracemalloc.reset_peak()
+            baseline, _ = tracemalloc.get_traced_memory()
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record['seconds'] = round(time.perf_counter() - start, 4)
+            if self.trace_memory:
+                _, peak = tracemalloc.get_traced_memory()
+                record['peak_mb'] = round((peak - baseline) / (1024 * 1024), 2)
+                if started_tracing:
+                    tracemalloc.stop()
+                _TRACE_LOCK.release()
+            self.stages.pop(name, None)
+            self.stages[name] = record
+
+    def child(self):
+        """
+        An empty profiler with the same settings, for one part of a run that merge adds back
+        """
+        return StageProfiler(self.trace_memory, self.listener)
+
+    def merge(self, other):
+        """
+        Add the stages of other: times and rows are summed, peak memory is the larger one
+        """
+        for name, record in other.stages.items():
+            if name not in self.stages:
+                self.stages[name] = dict(record)
+                continue
+            current = self.stages[name]
+            current['seconds'] = round((current['seconds'] or 0) + (record['seconds'] or 0), 4)
+            if record['rows'] is not None:
+                current['rows'] = (current['rows'] or 0) + record['rows']
+            if record['peak_mb'] is not None:
+                current['peak_mb'] = max(current['peak_mb'] or 0, record['peak_mb'])
+
+    def record_accounts(self, adgroup_df, result_df, ad_rows=None):
+        """
+        Per-account breakdown: ad report rows and result rows per Customer ID
+
+        ad_rows (ad report rows per Customer ID) can be given instead of adgroup_df.
+        """
+        if ad_rows is None:
+            ad_rows = adgroup_df['Customer ID'].value_counts() if 'Customer ID' in adgroup_df.columns else pd.Series(dtype='int64')
+        result_rows = result_df['Customer ID'].value_counts()
+        accounts = pd.DataFrame({'ad_rows': ad_rows, 'result_rows': result_rows})
+        accounts = accounts[accounts['result_rows'].notna()].fillna(0).astype('int64')
+        self.accounts = accounts.rename_axis('Customer ID').reset_index()
+
+    def record_session_memory(self, before, after):
+        """
+        Estimated memory of what a session keeps, before and after compaction
+        """
+        self.session_memory = {
+            'before_mb': round(estimate_bytes(before) / (1024 * 1024), 2),
+            'after_mb': round(estimate_bytes(after) / (1024 * 1024), 2)
+        }
+
+    def to_frame(self):
+        return pd.DataFrame(list(self.stages.values()), columns=['stage', 'rows', 'seconds', 'peak_mb'])
+
+    def total_seconds(self):
+        return round(sum(record['seconds'] or 0 for record in self.stages.values()), 4)
+
+    def to_json(self):
+        report = {
+            'trace_memory': self.trace_memory,
+            'total_seconds': self.total_seconds(),
+            'stages': list(self.stages.values())
+        }
+        if self.session_memory is not None:
+            report['session_memory'] = self.session_memory
+        if self.accounts is not None:
+            report['accounts'] = json.loads(self.accounts.to_json(orient='records'))
+        return json.dumps(report, indent=2, default=str)
@@ -0,0 +1,187 @@
+"""
+Generate realistic accounts_list, ad_report and keyword_report files for testing and benchmarks
+
+Example:
+    python synthetic_data.py --accounts 2000 --ad-groups-per-account 20 --output-dir data
+"""
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+# Ad group names following one of the default patterns in analysis.DEFAULT_AD_GROUP_PATTERNS
+MATCHING_AD_GROUPS = [
+    'New - Lease- {year} {model}',
+    'Lease or Other {year} {model}',
+    'Other Deal {year} {model}',
+    'Finance Other {year} {model}',
+    'New - Rebate Deal- {year} {model}',
+    'New - Deal - {year} {model}',
+    'Other or Finance {year} {model}',
+    'Finance or Other {year} {model}',
+    'Lease or Finance {year} {model}'
+]
+
+# Ad group names that look similar but do not have a valid structure
+OTHER_AD_GROUPS = [
+    '{model} - Brand',
+    'Service {model}',
+    'New - Lease {year} {model}',
+    'Used {model} {year}',
+    'Finance {model}'
+]
+
+MODELS = ['Civic', 'Accord', 'CR-V', 'Pilot', 'Camry', 'RAV4', 'F-150', 'Explorer', 'Tahoe', 'Model 3']
+CAMPAIGNS = ['IM_VDP - New', 'IM_VDP - Lease', 'IM_VDP - Finance', 'Brand', 'Service']
+HEADLINES = 15
+DESCRIPTIONS = 4
+
+def customer_id_text(values):
+    """
+    Google Ads style "123-456-7890" Customer IDs
+    """
+    digits = pd.Series(values).astype(str).str.zfill(10)
+    return (digits.str[:3] + '-' + digits.str[3:6] + '-' + digits.str[6:]).to_numpy()
+
+def fill_names(templates, years, models):
+    """
+    Format the chosen templates with a year and model, one name per row
+    """
+    names = np.empty(len(templates), dtype=object)
+    for template in np.unique(templates):
+        rows = templates == template
+        names[rows] = [template.format(year=year, model=model) for year, model in zip(years[rows], models[rows])]
+    return names
+
+def generate_reports(accounts=1000, ad_groups_per_account=10, ads_per_ad_group=3, pattern_hit_rate=0.6,
+                     keyword_density=8.0, enabled_rate=0.85, creative_fill_rate=0.9, seed=0):
+    """
+    Build the three reports as DataFrames: (accounts_df, keyword_df, adgroup_df)
+
+    pattern_hit_rate is the share of ad groups with a valid naming structure,
+    keyword_density the average number of keywords per ad group and
+    creative_fill_rate the share of ads that have any headline or description.
+    About 10% of the listed accounts have no ad groups at all.
+    """
+    rng = np.random.default_rng(seed)
+
+    # Accounts: every tenth listed account is missing from the ad report
+    customer_numbers = 1_000_000_000 + rng.choice(9_000_000_000, accounts, replace=False)
+    customer_ids = customer_id_text(customer_numbers)
+    account_names = np.array([f'Dealer {i:05d}' for i in range(accounts)], dtype=object)
+    accounts_df = pd.DataFrame({'Customer ID': customer_ids, 'Account name': account_names})
+    active_accounts = np.flatnonzero(np.arange(accounts) % 10 != 9)
+
+    # Ad groups
+    n_ad_groups = len(active_accounts) * ad_groups_per_account
+    ad_group_account = np.repeat(active_accounts, ad_groups_per_account)
+    ad_group_ids = np.arange(n_ad_groups, dtype=np.int64) + 100_000_000_000
+    matching = rng.random(n_ad_groups) < pattern_hit_rate
+    templates = np.where(
+        matching,
+        np.array(MATCHING_AD_GROUPS, dtype=object)[rng.integers(0, len(MATCHING_AD_GROUPS), n_ad_groups)],
+        np.array(OTHER_AD_GROUPS, dtype=object)[rng.integers(0, len(OTHER_AD_GROUPS), n_ad_groups)]
+    )
+    ad_group_names = fill_names(
+        templates,
+        rng.integers(2020, 2027, n_ad_groups),
+        np.array(MODELS, dtype=object)[rng.integers(0, len(MODELS), n_ad_groups)]
+    )
+    ad_group_campaigns = np.array(CAMPAIGNS, dtype=object)[rng.integers(0, len(CAMPAIGNS), n_ad_groups)]
+
+    # Ads: ads_per_ad_group rows per ad group
+    ad_rows = np.repeat(np.arange(n_ad_groups), ads_per_ad_group)
+    n_ads = len(ad_rows)
+    adgroup_df = pd.DataFrame({
+        'Customer ID': customer_ids[ad_group_account[ad_rows]],
+        'Account name': account_names[ad_group_account[ad_rows]],
+        'Campaign': ad_group_campaigns[ad_rows],
+        'Ad group': ad_group_names[ad_rows],
+        'Ad group ID': ad_group_ids[ad_rows],
+        'Ad state': np.where(rng.random(n_ads) < enabled_rate, 'Enabled', 'Paused')
+    })
+    has_creative = rng.random(n_ads) < creative_fill_rate
+    for i in range(1, HEADLINES + 1):
+        # Early headlines are almost always filled, later ones rarely
+        filled = has_creative & (rng.random(n_ads) < (0.95 if i <= 3 else 0.3))
+        adgroup_df[f'Headline {i}'] = np.where(filled, f'Great deals on headline {i}', '--')
+    for i in range(1, DESCRIPTIONS + 1):
+        filled = has_creative & (rng.random(n_ads) < (0.9 if i <= 2 else 0.2))
+        adgroup_df[f'Description {i}'] = np.where(filled, f'Visit us today, offer {i}', None)
+
+    # Keywords: Poisson number of keywords per ad group, some ad groups get none
+    keyword_counts = rng.poisson(keyword_density, n_ad_groups)
+    keyword_rows = np.repeat(np.arange(n_ad_groups), keyword_counts)
+    n_keywords = len(keyword_rows)
+    keyword_df = pd.DataFrame({
+        'Customer ID': customer_ids[ad_group_account[keyword_rows]],
+        'Campaign': ad_group_campaigns[keyword_rows],
+        'Ad group': ad_group_names[keyword_rows],
+        'Ad group ID': ad_group_ids[keyword_rows],
+        'Keyword': [f'keyword {i}' for i in range(n_keywords)],
+        'Status': np.where(rng.random(n_keywords) < 0.9, 'Enabled', 'Paused')
+    })
+    return accounts_df, keyword_df, adgroup_df
+
+def generate_reports_for_rows(ad_rows, ad_groups_per_account=10, ads_per_ad_group=3, **kwargs):
+    """
+    generate_reports sized by the number of ad report rows
+    """
+    accounts = max(1, int(round(ad_rows / (ad_groups_per_account * ads_per_ad_group * 0.9))))
+    return generate_reports(accounts, ad_groups_per_account, ads_per_ad_group, **kwargs)
+
+def write_report(df, path, title):
+    """
+    Write a report like the Google Ads export: two title rows, header on row 3
+    """
+    if path.lower().endswith('.csv'):
+        with open(path, 'w', encoding='utf-8', newline='') as f:
+            f.write(f'{title}\nAll time\n')
+            df.to_csv(f, index=False)
+    else:
+        with pd.ExcelWriter(path, engine='openpyxl') as writer:
+            pd.DataFrame([[title], ['All time']]).to_excel(writer, index=False, header=False)
+            df.to_excel(writer, index=False, startrow=2)
+
+def write_reports(accounts_df, keyword_df, adgroup_df, output_dir, fmt='xlsx'):
+    """
+    Write the three reports to output_dir; returns their paths
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    paths = (
+        os.path.join(output_dir, f'accounts_list.{fmt}'),
+        os.path.join(output_dir, f'keyword_report.{fmt}'),
+        os.path.join(output_dir, f'ad_report.{fmt}')
+    )
+    write_report(accounts_df, paths[0], 'Accounts')
+    write_report(keyword_df, paths[1], 'Search keyword report')
+    write_report(adgroup_df, paths[2], 'Ad report')
+    return paths
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate synthetic Google Ads reports")
+    parser.add_argument('--accounts', type=int, default=1000)
+    parser.add_argument('--ad-groups-per-account', type=int, default=10)
+    parser.add_argument('--ads-per-ad-group', type=int, default=3)
+    parser.add_argument('--pattern-hit-rate', type=float, default=0.6)
+    parser.add_argument('--keyword-density', type=float, default=8.0, help="average keywords per ad group")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--format', choices=['xlsx', 'csv', 'both'], default='xlsx')
+    parser.add_argument('--output-dir', default='synthetic_data')
+    args = parser.parse_args(argv)
+
+    frames = generate_reports(
+        accounts=args.accounts,
+        ad_groups_per_account=args.ad_groups_per_account,
+        ads_per_ad_group=args.ads_per_ad_group,
+        pattern_hit_rate=args.pattern_hit_rate,
+        keyword_density=args.keyword_density,
+        seed=args.seed
+    )
+    for fmt in (['xlsx', 'csv'] if args.format == 'both' else [args.format]):
+        for path in write_reports(*frames, args.output_dir, fmt):
+            print(path)
+
+if __name__ == '__main__':
+    main()